@@ -0,0 +1,77 @@
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from main import Game
+from scripts.entities import Enemy
+
+COUNT = 10000
+TICKS = 50
+
+
+def spawn_points(game, count, seed=1):
+    # враги ставятся над твердыми тайлами уровня, чтобы они стояли и ходили, а не падали
+    rng = random.Random(seed)
+    ground = [(x * game.tilemap.tile_size, (y - 1) * game.tilemap.tile_size)
+              for x, y, tile_type, variant in game.tilemap.tiles()
+              if game.tilemap.is_solid(x, y) and not game.tilemap.is_solid(x, y - 1)]
+    return [rng.choice(ground) for _ in range(count)]
+
+
+def measure(count=COUNT, ticks=TICKS, level=0):
+    game = Game(headless=True, activity_radius=0, seed=1)
+    game.current_level = level
+    game.load_level(level)
+    points = spawn_points(game, count)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    enemies = [Enemy(game, pos, (10, 10)) for pos in points]
+    entity_bytes = tracemalloc.get_traced_memory()[0] - before
+
+    # пара тиков на прогрев: после первых шагов pos и prev_pos перестают делить объекты чисел
+    for _ in range(3):
+        for enemy in enemies:
+            enemy.update(game.tilemap)
+
+    # пик временной памяти за тик - сколько аллоцируется и тут же выбрасывается
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    for enemy in enemies:
+        enemy.update(game.tilemap)
+    peak = tracemalloc.get_traced_memory()[1] - start_memory
+    tracemalloc.stop()
+
+    collections = [0]
+
+    def count_collections(phase, info):
+        if phase == 'start':
+            collections[0] += 1
+
+    gc.callbacks.append(count_collections)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for enemy in enemies:
+            enemy.update(game.tilemap)
+    elapsed = time.perf_counter() - start
+    gc.callbacks.remove(count_collections)
+
+    return {
+        'entities': count,
+        'bytes_per_entity': entity_bytes / count,
+        'tick_ms': elapsed / ticks * 1000,
+        'transient_peak_kb_per_tick': peak / 1024,
+        'gc_collections_per_100_ticks': collections[0] * 100 / ticks
+    }
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    for name, value in measure(count).items():
+        print('%-30s %.2f' % (name, value))
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from benchmarks.entities import spawn_points
+from main import Game
+from scripts.entities import Enemy
+from scripts.mapformat import json_to_binary
+from scripts.tilemap import Tilemap
+
+# размеры карт в тайлах и доля заполненных клеток; все случайное идет от SEED
+SIZES = {
+    'small': (128, 64),
+    'medium': (512, 256),
+    'large': (1024, 512)
+}
+DENSITIES = (0.2, 0.6)
+ENEMY_COUNTS = (100, 1000)
+SEED = 1
+QUERIES = 20000
+RENDER_FRAMES = 200
+UPDATE_TICKS = 20
+THRESHOLD = 0.1
+
+
+def generate_map(path, width, height, density, seed=SEED):
+    # карта в обычной схеме json: земля снизу, над ней платформы, декор и спавнеры вне сетки
+    rng = random.Random(seed)
+    tilemap = {}
+
+    def put(x, y, tile_type):
+        tilemap[str(x) + ';' + str(y)] = {
+            'type': tile_type,
+            'variant': rng.randrange(9),
+            'pos': [x, y]
+        }
+
+    ground = height * 3 // 4
+    for x in range(width):
+        for y in range(ground, height):
+            if rng.random() < 0.5 + density / 2:
+                put(x, y, 'stone' if y > ground + 2 else 'grass')
+    platforms = int(width * ground * density / 8)
+    for _ in range(platforms):
+        x = rng.randrange(width)
+        y = rng.randrange(ground)
+        tile_type = rng.choice(['grass', 'stone'])
+        for i in range(rng.randint(2, 10)):
+            if x + i < width:
+                put(x + i, y, tile_type)
+
+    offgrid = []
+    for _ in range(width * height // 200):
+        offgrid.append({
+            'type': rng.choice(['decor', 'large_decor']),
+            'variant': rng.randrange(2),
+            'pos': [rng.uniform(0, width * 16), rng.uniform(0, ground * 16)]
+        })
+    for i in range(1 + width * height // 2000):
+        offgrid.append({
+            'type': 'spawners',
+            'variant': 0 if i == 0 else 1,
+            'pos': [rng.uniform(0, width * 16), rng.uniform(0, ground * 16)]
+        })
+
+    with open(path, 'w') as f:
+        json.dump({'tilemap': tilemap, 'tile_size': 16, 'offgrid': offgrid}, f)
+    return len(tilemap)
+
+
+def timed(func, repeat=3, setup=None):
+    # медиана из repeat прогонов, в миллисекундах
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def random_points(tilemap, count, seed=SEED):
+    rng = random.Random(seed)
+    left, top, width, height = tilemap.bounds()
+    return [(rng.uniform(left, left + width), rng.uniform(top, top + height)) for _ in range(count)]
+
+
+def bench_map(game, name, json_path, map_path, results, repeat):
+    def record(bench, value, unit='ms'):
+        results[name + '/' + bench] = {'value': value, 'unit': unit}
+        print('%-40s %12.4f %s' % (name + '/' + bench, value, unit))
+
+    tilemap = Tilemap(game)
+    record('load_json', timed(lambda: tilemap.load(json_path), repeat))
+    record('load_map', timed(lambda: tilemap.load(map_path), repeat))
+    record('load_map_all_chunks', timed(lambda: (tilemap.load(map_path), tilemap.load_all_chunks()), repeat))
+
+    tilemap.load(json_path)
+    points = random_points(tilemap, QUERIES)
+    for bench, query in (('tiles_around', tilemap.tiles_around),
+                         ('physics_rects_around', tilemap.physics_rects_around),
+                         ('solid_check', tilemap.solid_check)):
+        total = timed(lambda: [query(point) for point in points], repeat)
+        record(bench, total * 1000 / QUERIES, 'us/call')
+
+    record('autotile', timed(tilemap.autotile, repeat))
+
+    pairs = [('spawners', 0), ('spawners', 1)]
+    record('extract', timed(lambda: tilemap.extract(pairs), repeat, setup=lambda: tilemap.load(json_path)))
+
+    surf = pygame.Surface((320, 240))
+    offsets = [(int(x), int(y)) for x, y in random_points(tilemap, RENDER_FRAMES, seed=SEED + 1)]
+
+    def render_all():
+        for offset in offsets:
+            tilemap.render(surf, offset=offset)
+
+    def drop_surfaces():
+        tilemap.chunk_surfaces = {}
+
+    record('render_cold', timed(render_all, repeat, setup=drop_surfaces) / RENDER_FRAMES, 'ms/frame')
+    record('render_warm', timed(render_all, repeat) / RENDER_FRAMES, 'ms/frame')
+
+    # враги берут картинки из game, точки появления - на земле синтетической карты
+    game.tilemap = tilemap
+    for count in ENEMY_COUNTS:
+        game.rng.seed(SEED)
+        enemies = [Enemy(game, pos, (8, 15)) for pos in spawn_points(game, count, seed=SEED)]
+
+        def update_all():
+            for _ in range(UPDATE_TICKS):
+                for enemy in enemies:
+                    enemy.update(tilemap)
+
+        record('enemy_update_%d' % count, timed(update_all, repeat) / UPDATE_TICKS, 'ms/tick')
+
+
+def run(sizes, repeat):
+    game = Game(headless=True, activity_radius=0)
+    results = {}
+    directory = tempfile.mkdtemp(prefix='space_sentinel_bench_')
+    try:
+        for size in sizes:
+            width, height = SIZES[size]
+            for density in DENSITIES:
+                name = '%s_%d' % (size, round(density * 100))
+                json_path = os.path.join(directory, name + '.json')
+                map_path = os.path.join(directory, name + '.map')
+                tiles = generate_map(json_path, width, height, density)
+                json_to_binary(json_path, map_path)
+                print('# %s: %dx%d, %d tiles' % (name, width, height, tiles))
+                bench_map(game, name, json_path, map_path, results, repeat)
+    finally:
+        shutil.rmtree(directory)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'seed': SEED,
+            'repeat': repeat,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    # все метрики - время, больше значит хуже; возвращает число регрессий
+    regressions = 0
+    print('%-40s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'ratio'))
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['value']
+        after = result['value']
+        ratio = after / before if before else float('inf')
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = 'SLOWER'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            mark = 'faster'
+        print('%-40s %12.4f %12.4f %7.2fx %s' % (name, before, after, ratio, mark))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='headless benchmarks over synthetic maps')
+    parser.add_argument('--sizes', default='small,medium',
+                        help='comma separated: ' + ','.join(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--baseline',
+                        help='results file to compare with; exit code 1 if something got slower')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    current = run(args.sizes.split(','), args.repeat)
+    with open(args.out, 'w') as f:
+        json.dump(current, f, indent=2)
+    print('saved', args.out)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            sys.exit(1)
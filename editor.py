@@ -2,29 +2,33 @@ import sys
 
 import pygame
 
-from scripts.utils import load_images
+from scripts.assets import get_assets
+from scripts.journal import EditJournal
+from scripts.present import Presenter
 from scripts.tilemap import Tilemap
 
 RENDER_SCALE = 2.0
+MAP_PATH = 'map.json'
+TILE_GROUPS = ['decor', 'grass', 'large_decor', 'stone', 'spawners']
+# для .map карт в памяти держатся только чанки вокруг экрана, проверка раз в STREAM_INTERVAL кадров
+STREAM_INTERVAL = 60
+STREAM_MARGIN = 2
 
 
 class Editor:
-    def __init__(self):
+    def __init__(self, map_path=MAP_PATH):
         pygame.init()
 
         pygame.display.set_caption('editor')
         self.screen = pygame.display.set_mode((640, 480))
         self.display = pygame.Surface((320, 240))
+        # картинка редактора почти не меняется между кадрами: на экран идут только изменившиеся полосы
+        self.presenter = Presenter(self.screen, self.display, dirty=True)
 
         self.clock = pygame.time.Clock()
 
-        self.assets = {
-            'decor': load_images('tiles/decor'),
-            'grass': load_images('tiles/grass'),
-            'large_decor': load_images('tiles/large_decor'),
-            'stone': load_images('tiles/stone'),
-            'spawners': load_images('tiles/spawners'),
-        }
+        # те же картинки, что и у игры; анимации и фон редактору не нужны и не грузятся
+        self.assets = get_assets()
 
         self.movement = [False,
                          False,
@@ -34,13 +38,16 @@ class Editor:
         self.tilemap = Tilemap(self, tile_size=16)
 
         try:
-            self.tilemap.load('map.json')
+            self.tilemap.load(map_path)
         except FileNotFoundError:
             pass
+        # правки после последнего сохранения лежат в журнале и накатываются здесь
+        self.journal = EditJournal(self.tilemap, map_path)
+        self.frame = 0
 
         self.scroll = [0, 0]
 
-        self.tile_list = list(self.assets)
+        self.tile_list = TILE_GROUPS
         self.tile_group = 0
         self.tile_variant = 0
 
@@ -48,6 +55,8 @@ class Editor:
         self.right_clicking = False
         self.shift = False
         self.ongrid = True
+        # автотайлинг при рисовании: перестраиваются только измененная клетка и ее соседи
+        self.auto_tiling = False
 
     def run(self):
         while True:
@@ -60,6 +69,14 @@ class Editor:
             render_scroll = (int(self.scroll[0]),
                              int(self.scroll[1]))
 
+            self.frame += 1
+            if self.frame % STREAM_INTERVAL == 0:
+                self.tilemap.evict_chunks((render_scroll[0],
+                                           render_scroll[1],
+                                           self.display.get_width(),
+                                           self.display.get_height()),
+                                          STREAM_MARGIN)
+
             self.tilemap.render(self.display, offset=render_scroll)
 
             current_tile_img = self.assets[self.tile_list[self.tile_group]][self.tile_variant].copy()
@@ -81,36 +98,25 @@ class Editor:
                                   mpos)
 
             if self.clicking and self.ongrid:
-                self.tilemap.tilemap[str(tile_pos[0])
-                                     + ';'
-                                     + str(tile_pos[1])] = \
-                    {
-                        'type': self.tile_list[self.tile_group],
-                        'variant': self.tile_variant,
-                        'pos': tile_pos
-                    }
+                self.journal.place(tile_pos[0],
+                                   tile_pos[1],
+                                   self.tile_list[self.tile_group],
+                                   self.tile_variant,
+                                   autotile=self.auto_tiling)
             if self.right_clicking:
-                tile_loc = (str(tile_pos[0])
-                            + ';'
-                            + str(tile_pos[1]))
-                if tile_loc in self.tilemap.tilemap:
-                    del self.tilemap.tilemap[tile_loc]
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_img = self.assets[tile['type']][tile['variant']]
-                    tile_r = pygame.Rect(tile['pos'][0]
-                                         - self.scroll[0],
-                                         tile['pos'][1]
-                                         - self.scroll[1],
-                                         tile_img.get_width(),
-                                         tile_img.get_height())
-                    if tile_r.collidepoint(mpos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                self.journal.remove(tile_pos[0],
+                                    tile_pos[1],
+                                    autotile=self.auto_tiling)
+                for tile in self.tilemap.offgrid_at((mpos[0] + self.scroll[0],
+                                                     mpos[1] + self.scroll[1])):
+                    self.journal.remove_offgrid(tile)
 
             self.display.blit(current_tile_img,
                               (5, 5))
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    self.journal.close()
                     pygame.quit()
                     sys.exit()
 
@@ -118,7 +124,7 @@ class Editor:
                     if event.button == 1:
                         self.clicking = True
                         if not self.ongrid:
-                            self.tilemap.offgrid_tiles.append(
+                            self.journal.add_offgrid(
                                 {
                                     'type': self.tile_list[self.tile_group],
                                     'variant': self.tile_variant,
@@ -163,9 +169,16 @@ class Editor:
                     if event.key == pygame.K_g:
                         self.ongrid = not self.ongrid
                     if event.key == pygame.K_t:
-                        self.tilemap.autotile()
+                        if self.shift:
+                            self.auto_tiling = not self.auto_tiling
+                        else:
+                            self.journal.autotile()
                     if event.key == pygame.K_o:
-                        self.tilemap.save('map.json')
+                        self.journal.compact()
+                    if event.key == pygame.K_z and event.mod & pygame.KMOD_CTRL:
+                        self.journal.undo()
+                    if event.key == pygame.K_y and event.mod & pygame.KMOD_CTRL:
+                        self.journal.redo()
                     if event.key == pygame.K_LSHIFT:
                         self.shift = True
                 if event.type == pygame.KEYUP:
@@ -180,10 +193,9 @@ class Editor:
                     if event.key == pygame.K_LSHIFT:
                         self.shift = False
 
-            self.screen.blit(pygame.transform.scale(self.display, self.screen.get_size()),
-                             (0, 0))
-            pygame.display.update()
+            self.presenter.present()
+            self.journal.flush()
             self.clock.tick(60)
 
 
-Editor().run()
+Editor(sys.argv[1] if len(sys.argv) > 1 else MAP_PATH).run()
@@ -1,56 +1,125 @@
+import argparse
+import hashlib
+import os
+import random
 import sys
+import time
+
 import pygame
 
-from scripts.utils import load_image, load_images, Animation
+from scripts.activity import ActivityRegions
+from scripts.assets import get_assets
+from scripts.batch import EnemyBatch
 from scripts.entities import Player, Enemy
-from scripts.tilemap import Tilemap
+from scripts.levels import LevelCache
+from scripts.mapformat import MAP_EXTENSION
+from scripts.present import Presenter
+from scripts.profiler import Profiler
+from scripts.projectiles import Projectiles
+from scripts.replay import SEED_LIMIT, InputRecorder, Recording
+from scripts.spatial import SpatialHash
+
+INPUT_KEYS = {
+    pygame.K_LEFT: 'left',
+    pygame.K_RIGHT: 'right',
+    pygame.K_UP: 'jump',
+    pygame.K_z: 'shoot'
+}
+
+
+# анимации сущностей и пуля нужны все время игры и не выгружаются
+PINNED_ASSETS = ('enemy/idle',
+                 'enemy/run',
+                 'player/idle',
+                 'player/run',
+                 'player/jump',
+                 'player/shoot',
+                 'bullet')
+
+SIM_RATE = 60
+MAX_FRAME_TIME = 0.25
+
+
+def empty_inputs():
+    return {name: False for name in INPUT_KEYS.values()}
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, max_fps=60, batch_physics=False, activity_radius=480, profiler=None,
+                 seed=None, record_path=None, dirty_rects=False, asset_budget=None):
+        self.headless = headless
+        # вся случайность симуляции идет из self.rng: одинаковый seed и ввод - одинаковая игра
+        if seed is None and record_path is not None:
+            seed = random.randrange(SEED_LIMIT)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.record_path = record_path
+        self.recorder = None
+        # время фаз кадра, F3 - таблица поверх игры (python main.py --profile)
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.max_fps = max_fps
+        self.batch_physics = batch_physics
+        self.enemy_batch = EnemyBatch()
+        self.activity = ActivityRegions(radius=activity_radius)
+        self.tick_time = 1 / SIM_RATE
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
         pygame.init()
         self.moving_left = False
         self.moving_right = False
-        pygame.display.set_caption('Space Sentinel')
-        self.screen = pygame.display.set_mode((640,
-                                               480))
+        if headless:
+            # окно не показывается, но видеорежим нужен для convert()
+            self.screen = pygame.display.set_mode((1,
+                                                   1))
+        else:
+            pygame.display.set_caption('Space Sentinel')
+            self.screen = pygame.display.set_mode((640,
+                                                   480))
         self.display = pygame.Surface((320,
                                        240))
+        # увеличение в окно идет в готовую поверхность экрана; dirty_rects - обновлять только изменившиеся полосы
+        self.presenter = Presenter(self.screen,
+                                   self.display,
+                                   dirty=dirty_rects)
         self.current_level = None
         self.clock = pygame.time.Clock()
 
         self.movement = [False, False]
-
-        self.assets = {
-            'decor': load_images('tiles/decor'),
-            'grass': load_images('tiles/grass'),
-            'large_decor': load_images('tiles/large_decor'),
-            'stone': load_images('tiles/stone'),
-            'background': load_image('background.png'),
-            'enemy/idle': Animation(load_images('entities/enemy/idle'),
-                                    img_dur=6),
-            'enemy/run': Animation(load_images('entities/enemy/run'),
-                                   img_dur=15),
-            'spawners': load_images('tiles/spawners'),
-            'player/idle': Animation(load_images('entities/player/idle'),
-                                     img_dur=6),
-            'player/run': Animation(load_images('entities/player/run'),
-                                    img_dur=15),
-            'player/jump': Animation(load_images('entities/player/jump')),
-            'player/shoot': Animation(load_images('entities/player/shoot')),
-            'bullet': load_image('entities/bullet.png'),
-        }
+        self.inputs = empty_inputs()
+        self.held_inputs = empty_inputs()
+        self.pressed = set()
+        self.completed = False
+        # экран с собственным циклом событий (меню) ставит blocked, run не догоняет тиками время в нем
+        self.blocked = False
+
+        # картинки грузятся при первом обращении; то, что не нужно, выгружается сверх бюджета памяти
+        self.assets = get_assets()
+        if asset_budget is not None:
+            self.assets.set_budget(asset_budget)
+        for name in PINNED_ASSETS:
+            self.assets.acquire(name)
+        self.level_assets = ()
+        # фон увеличивается один раз: в кадр попадает только его левый верхний угол размером с display
+        self.background = pygame.transform.scale(self.assets.acquire('background'),
+                                                 (640, 480)).subsurface(self.display.get_rect()).copy()
+        # исходный фон 4096x2304 после этого не нужен
+        self.assets.release('background')
 
         self.player = Player(self, (50, 50),
                              (10, 11))
 
-        self.bullet = pygame.image.load('data/images/entities/bullet.png').convert_alpha()
+        self.bullet = self.assets['bullet']
+        self.bullet_images = {
+            1: self.bullet,
+            -1: pygame.transform.flip(self.bullet, True, False)
+        }
         self.start_screen_bg = pygame.image.load('data/images/start_screen_background.png').convert()
-        self.bullets = list()
+        self.bullets = Projectiles(self.bullet.get_size())
+        self.enemy_hash = SpatialHash(32)
         self.level_chosen = False
 
-        self.tilemap = Tilemap(self,
-                               tile_size=16)
+        self.levels = LevelCache(self,
+                                 tile_size=16)
         self.load_level(1)
 
     def show_start_screen(self):
@@ -68,6 +137,7 @@ class Game:
                          text_rect)
         pygame.display.flip()
 
+        self.blocked = True
         self.level_chosen = False
         while not self.level_chosen:
             for event in pygame.event.get():
@@ -105,20 +175,66 @@ class Game:
                     pygame.quit()
                     sys.exit()
 
-    def load_level(self, map_id):
-        self.tilemap.load('data/maps/' + str(map_id) + '.json')
+    def level_path(self, map_id):
+        # бинарная карта, если она собрана, иначе json
+        path = 'data/maps/' + str(map_id)
+        if os.path.exists(path + MAP_EXTENSION):
+            return path + MAP_EXTENSION
+        return path + '.json'
 
+    def spawn(self, level):
         self.enemies = list()
-        for spawner in self.tilemap.extract([('spawners', 0),
-                                             ('spawners', 1)]):
-            if spawner['variant'] == 0:
-                self.player.pos = spawner['pos']
+        for variant, pos in level.spawners:
+            if variant == 0:
+                self.player.pos = list(pos)
+                self.player.prev_pos = list(pos)
+                self.player.velocity = [0, 0]
             else:
                 self.enemies.append(Enemy(self,
-                                          spawner['pos'],
+                                          pos,
                                           (10, 10)))
 
+        self.bullets.clear()
         self.scroll = [0, 0]
+        self.prev_scroll = [0, 0]
+
+    def snapshot(self):
+        return {
+            'player': self.player.snapshot(),
+            'enemies': tuple(enemy.snapshot() for enemy in self.enemies),
+            'bullets': self.bullets.snapshot(),
+            'scroll': tuple(self.scroll),
+            'prev_scroll': tuple(self.prev_scroll)
+        }
+
+    def restore(self, snapshot):
+        self.player.restore(snapshot['player'])
+        self.enemies = list()
+        for state in snapshot['enemies']:
+            enemy = Enemy(self, state[0][0], (10, 10))
+            enemy.restore(state)
+            self.enemies.append(enemy)
+        self.bullets.restore(snapshot['bullets'])
+        self.scroll = list(snapshot['scroll'])
+        self.prev_scroll = list(snapshot['prev_scroll'])
+
+    def load_level(self, map_id):
+        # файл уровня читается один раз, дальше рестарт - это восстановление снимка начала уровня
+        level = self.levels.get(map_id)
+        self.tilemap = level.tilemap
+        # тайлы нового уровня закрепляются раньше, чем отпускаются тайлы старого, общие не выгружаются
+        for name in level.asset_names:
+            self.assets.acquire(name)
+        for name in self.level_assets:
+            self.assets.release(name)
+        self.level_assets = level.asset_names
+        if level.start is None:
+            self.spawn(level)
+            level.start = self.snapshot()
+        else:
+            self.restore(level.start)
+        # к переходу на следующий уровень он уже прочитан и собран в фоне
+        self.levels.preload(map_id + 1)
 
     def is_dead(self, player,
                 level,
@@ -134,124 +250,319 @@ class Game:
         self.load_level(level)
         bullets.clear()
 
+    def step(self, inputs):
+        held = self.held_inputs
+        self.prev_scroll[0] = self.scroll[0]
+        self.prev_scroll[1] = self.scroll[1]
+        self.movement[0] = inputs['left']
+        self.movement[1] = inputs['right']
+        self.moving_left = inputs['left']
+        self.moving_right = inputs['right']
+
+        if (self.current_level == 0 and self.player.pos[0] >= 1008 and self.player.pos[1] == 501
+                and self.player.pos[0] <= 1046):
+            self.current_level = 1
+            self.load_level(self.current_level)
+        if (self.current_level == 1 and self.player.pos[0] >= 1008 and self.player.pos[1] == 309 and
+                self.player.pos[0] <= 1046):
+            self.current_level = 2
+            self.load_level(self.current_level)
+        if (self.current_level == 2 and self.player.pos[0] >= 1136 and self.player.pos[1] == 213 and
+                self.player.pos[0] <= 1142):
+            self.completed = True
+
+        self.is_dead(self.player,
+                     self.current_level,
+                     self.bullets)
+
+        self.scroll[0] += ((self.player.rect().centerx
+                            - self.display.get_width()
+                            / 2 - self.scroll[0])
+                           / 30)
+        self.scroll[1] += ((self.player.rect().centery
+                            - self.display.get_height()
+                            / 2 - self.scroll[1])
+                           / 30)
+        profiler = self.profiler
+        profiler.begin('enemies')
+        # обновляются только враги рядом с камерой, остальные спят
+        active = self.activity.update(self.enemies,
+                                      (self.scroll[0] + self.display.get_width() / 2,
+                                       self.scroll[1] + self.display.get_height() / 2))
+        if self.batch_physics:
+            # все враги за один проход по массивам, результат тот же, что у Enemy.update
+            self.enemy_batch.update(self.tilemap,
+                                    active,
+                                    self.rng)
+        else:
+            for enemy in active.copy():
+                enemy.update(self.tilemap,
+                             (0, 0))
+        profiler.end('enemies')
+
+        profiler.begin('player')
+        self.player.update(self.tilemap,
+                           (self.movement[1]
+                            - self.movement[0], 0))
+        profiler.end('player')
+
+        if inputs['jump'] and not held['jump']:
+            self.player.jump()
+        if inputs['shoot'] != held['shoot']:
+            self.player.shoot()
+            if inputs['shoot']:
+                if self.player.flip:
+                    self.bullets.spawn(self.player.pos[0] - 15, self.player.pos[1], -1)
+                else:
+                    self.bullets.spawn(self.player.pos[0] + 15, self.player.pos[1], 1)
+        self.held_inputs = dict(inputs)
+
+        profiler.begin('bullets')
+        # враги раскладываются по ячейкам, пуля проверяется только с врагами рядом с ней
+        self.enemy_hash.rebuild(self.activity.visible(self.enemies))
+
+        if self.bullets:
+            # пули живут в мировых координатах и пропадают в стенах и за границей уровня
+            self.bullets.update(self.tilemap)
+
+            killed = set()
+            for i in self.bullets.active():
+                hits = self.enemy_hash.query(self.bullets.rect(i))
+                if hits:
+                    killed.add(hits[0])
+                    self.enemy_hash.remove(hits[0])
+                    self.bullets.kill(i)
+            if killed:
+                self.enemies = [enemy for enemy in self.enemies if enemy not in killed]
+                self.activity.forget(killed, self.enemies)
+        profiler.end('bullets')
+
+    def render(self, alpha=1.0):
+        profiler = self.profiler
+        profiler.begin('background')
+        self.display.blit(self.background,
+                          (0, 0))
+        profiler.end('background')
+
+        # рисуем между предыдущим и текущим тиком симуляции
+        render_scroll = (int(self.prev_scroll[0] + (self.scroll[0] - self.prev_scroll[0]) * alpha),
+                         int(self.prev_scroll[1] + (self.scroll[1] - self.prev_scroll[1]) * alpha))
+
+        profiler.begin('tilemap')
+        self.tilemap.render(self.display,
+                            offset=render_scroll)
+        profiler.end('tilemap')
+
+        profiler.begin('enemies_render')
+        for enemy in self.activity.visible(self.enemies):
+            enemy.render(self.display,
+                         offset=render_scroll,
+                         alpha=alpha)
+        profiler.end('enemies_render')
+
+        profiler.begin('player_render')
+        self.player.render(self.display,
+                           offset=render_scroll,
+                           alpha=alpha)
+        profiler.end('player_render')
+
+        profiler.begin('bullets_render')
+        self.bullets.render(self.display,
+                            self.bullet_images,
+                            offset=render_scroll,
+                            alpha=alpha)
+        profiler.end('bullets_render')
+
+        profiler.begin('present')
+        self.presenter.present(profiler.draw,
+                               full=profiler.enabled and profiler.overlay)
+        profiler.end('present')
+
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            if event.type == pygame.KEYDOWN:
+                if event.key in INPUT_KEYS:
+                    self.inputs[INPUT_KEYS[event.key]] = True
+                    self.pressed.add(INPUT_KEYS[event.key])
+                if event.key == pygame.K_ESCAPE:
+                    self.show_start_screen()
+                    self.presenter.invalidate()
+                    self.kill_player(self.current_level, self.bullets)
+                    if self.recorder is not None:
+                        self.recorder.restart(self.current_level)
+                if event.key == pygame.K_F3:
+                    self.profiler.toggle_overlay()
+
+            if event.type == pygame.KEYUP:
+                if event.key in INPUT_KEYS:
+                    self.inputs[INPUT_KEYS[event.key]] = False
+
+    def next_inputs(self):
+        # нажатие и отпускание между тиками все равно должно дойти до step
+        inputs = dict(self.inputs)
+        for name in self.pressed:
+            inputs[name] = True
+        self.pressed.clear()
+        return inputs
+
     def run(self):
         self.show_start_screen()  # Показываем стартовый экран
 
         # Если выбран уровень, загружаем его
         if self.current_level is not None:
             self.load_level(self.current_level)
-
+        self.rng.seed(self.seed)
+        if self.record_path is not None:
+            self.recorder = InputRecorder(self.record_path, self.seed, self.current_level,
+                                          self.activity.radius)
+
+        profiler = self.profiler
+        accumulator = 0
+        last_time = time.perf_counter()
         while True:
-            if (self.current_level == 0 and self.player.pos[0] >= 1008 and self.player.pos[1] == 501
-                    and self.player.pos[0] <= 1046):
-                self.current_level = 1
-                self.load_level(self.current_level)
-            if (self.current_level == 1 and self.player.pos[0] >= 1008 and self.player.pos[1] == 309 and
-                    self.player.pos[0] <= 1046):
-                self.current_level = 2
-                self.load_level(self.current_level)
-            if (self.current_level == 2 and self.player.pos[0] >= 1136 and self.player.pos[1] == 213 and
-                    self.player.pos[0] <= 1142):
-                self.complete_game()
-
-            self.is_dead(self.player,
-                         self.current_level,
-                         self.bullets)
-            self.display.blit(pygame.transform.scale(self.assets['background'], (640, 480)),
-                              (0, 0))
-
-            self.scroll[0] += ((self.player.rect().centerx
-                                - self.display.get_width()
-                                / 2 - self.scroll[0])
-                               / 30)
-            self.scroll[1] += ((self.player.rect().centery
-                                - self.display.get_height()
-                                / 2 - self.scroll[1])
-                               / 30)
-            render_scroll = (int(self.scroll[0]),
-                             int(self.scroll[1]))
-
-            self.tilemap.render(self.display,
-                                offset=render_scroll)
-
-            for enemy in self.enemies.copy():
-                enemy.update(self.tilemap,
-                             (0, 0))
-                enemy.render(self.display,
-                             offset=render_scroll)
-
-            self.player.update(self.tilemap,
-                               (self.movement[1]
-                                - self.movement[0], 0))
-            self.player.render(self.display,
-                               offset=render_scroll)
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT:
-                        self.movement[0] = True
-                        self.moving_left = True
-                    if event.key == pygame.K_RIGHT:
-                        self.movement[1] = True
-                        self.moving_right = True
-                    if event.key == pygame.K_UP:
-                        self.player.jump()
-                    if event.key == pygame.K_z:
-                        self.player.shoot()
-                        if self.player.flip:
-                            self.bullets.append([
-                                self.bullet.get_rect(top=self.player.pos[1] - render_scroll[1],
-                                                     left=self.player.pos[0] - render_scroll[0] - 15), -1])
-                        else:
-                            self.bullets.append([
-                                self.bullet.get_rect(top=self.player.pos[1] - render_scroll[1],
-                                                     left=self.player.pos[0] - render_scroll[0] + 15), 1])
-                    if event.key == pygame.K_ESCAPE:
-                        self.show_start_screen()
-                        self.kill_player(self.current_level, self.bullets)
-
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_LEFT:
-                        self.movement[0] = False
-                        self.moving_left = False
-                    if event.key == pygame.K_RIGHT:
-                        self.movement[1] = False
-                        self.moving_right = False
-                    if event.key == pygame.K_z:
-                        self.player.shoot()
-            if self.bullets:
-                bullets_to_remove = list()
-
-                for i, bullet in enumerate(self.bullets):
-                    flip = bullet[1] == -1
-                    bullet[0].x += 3 * bullet[1]
-                    bullet_rect = pygame.Rect(bullet[0].x,
-                                              bullet[0].y,
-                                              self.bullet.get_width(),
-                                              self.bullet.get_height())
-                    self.display.blit(pygame.transform.flip(self.bullet, flip,
-                                                            False), (bullet[0].x,
-                                                                     bullet[0].y))
-                    if bullet[0].x > (640 / 2) or bullet[0].x < 0:
-                        bullets_to_remove.append(i)
-
-                    for enemy in self.enemies:
-                        if bullet_rect.colliderect(enemy.rect()):
-                            self.enemies.remove(enemy)
-                            bullets_to_remove.append(i)
-                            break
-
-                for index in sorted(bullets_to_remove,
-                                    reverse=True):
-                    del self.bullets[index]
-
-            self.screen.blit(pygame.transform.scale(self.display,
-                                                    self.screen.get_size()), (0, 0))
-            pygame.display.update()
-            self.clock.tick(60)
-
-
-Game().run()
+            profiler.begin_frame()
+            now = time.perf_counter()
+            accumulator += min(now - last_time, MAX_FRAME_TIME)
+            last_time = now
+
+            profiler.begin('events')
+            self.handle_events()
+            profiler.end('events')
+            if self.blocked:
+                self.blocked = False
+                accumulator = 0
+                last_time = time.perf_counter()
+            while accumulator >= self.tick_time:
+                inputs = self.next_inputs()
+                if self.recorder is not None:
+                    self.recorder.record(inputs)
+                self.step(inputs)
+                accumulator -= self.tick_time
+                if self.completed:
+                    self.complete_game()
+
+            self.render(accumulator / self.tick_time)
+            profiler.begin('wait')
+            self.clock.tick(self.max_fps)
+            profiler.end('wait')
+            profiler.end_frame()
+
+    def soak(self, level, ticks, inputs=None):
+        self.current_level = level
+        self.load_level(level)
+        if inputs is None:
+            inputs = empty_inputs()
+
+        profiler = self.profiler
+        start = time.perf_counter()
+        for _ in range(ticks):
+            profiler.begin_frame()
+            self.step(inputs)
+            profiler.end_frame()
+        return ticks / (time.perf_counter() - start)
+
+    def replay(self, path, render=False):
+        # прогон записанного ввода без ограничения FPS, возвращает тиков в секунду
+        recording = Recording(path)
+        # радиус активности берется из записи, а не из --activity-radius
+        self.activity.radius = recording.activity_radius
+        self.activity.reset()
+        self.current_level = recording.level
+        self.load_level(recording.level)
+        self.rng.seed(recording.seed)
+
+        profiler = self.profiler
+        ticks = 0
+        start = time.perf_counter()
+        for kind, value in recording.events():
+            if kind == 'restart':
+                self.current_level = value
+                self.kill_player(value, self.bullets)
+                continue
+            profiler.begin_frame()
+            self.step(value)
+            if render:
+                self.render()
+            profiler.end_frame()
+            ticks += 1
+            if self.completed:
+                break
+        return ticks / (time.perf_counter() - start)
+
+    def state_digest(self):
+        # отпечаток состояния мира, чтобы сравнить поведение двух сборок на одной записи
+        # координаты приводятся к float: пакетная физика хранит их в массивах double
+        state = (self.current_level,
+                 tuple(map(float, self.player.pos)),
+                 tuple(map(float, self.player.velocity)),
+                 tuple(tuple(map(float, enemy.pos)) for enemy in self.enemies),
+                 self.bullets.snapshot())
+        return hashlib.md5(repr(state).encode()).hexdigest()
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        self.levels.close()
+        self.profiler.close()
+        for name in PINNED_ASSETS + self.level_assets:
+            self.assets.release(name)
+        self.level_assets = ()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--headless', action='store_true',
+                        help='run the simulation without a window and frame cap')
+    parser.add_argument('--level', type=int, default=0)
+    parser.add_argument('--batch-physics', action='store_true',
+                        help='update all enemies in one batched pass')
+    parser.add_argument('--activity-radius', type=int, default=480,
+                        help='enemies farther than this from the camera sleep, 0 - always update all')
+    parser.add_argument('--ticks', type=int, default=10000)
+    parser.add_argument('--fps', type=int, default=60,
+                        help='render frame cap, 0 - uncapped (simulation always runs at %d ticks/s)' % SIM_RATE)
+    parser.add_argument('--profile', action='store_true',
+                        help='time frame phases, F3 toggles the overlay')
+    parser.add_argument('--profile-out',
+                        help='write per-frame phase timings on exit: .csv or .json (Chrome trace)')
+    parser.add_argument('--seed', type=int,
+                        help='seed of the game random generator, 0 <= seed < 2**32')
+    parser.add_argument('--record',
+                        help='save per-tick input of this session to a file')
+    parser.add_argument('--replay',
+                        help='play back a recorded input file at uncapped speed')
+    parser.add_argument('--render', action='store_true',
+                        help='render every tick during --replay')
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help='update only the screen regions that changed since the last frame')
+    parser.add_argument('--asset-budget', type=float,
+                        help='MB of loaded images to keep when nothing uses them')
+    args = parser.parse_args()
+    if args.seed is not None and not 0 <= args.seed < SEED_LIMIT:
+        parser.error('--seed must be in range 0..%d' % (SEED_LIMIT - 1))
+
+    profiler = Profiler(enabled=args.profile, out_path=args.profile_out)
+    profiler.overlay = args.profile
+    game = Game(headless=args.headless or (args.replay is not None and not args.render),
+                max_fps=args.fps, batch_physics=args.batch_physics,
+                activity_radius=args.activity_radius, profiler=profiler,
+                seed=args.seed, record_path=args.record, dirty_rects=args.dirty_rects,
+                asset_budget=None if args.asset_budget is None else int(args.asset_budget * (1 << 20)))
+    try:
+        if args.replay:
+            print('%.1f ticks/s' % game.replay(args.replay, render=args.render))
+            print('state', game.state_digest())
+        elif args.headless:
+            game.rng.seed(args.seed)
+            print('%.1f ticks/s' % game.soak(args.level, args.ticks))
+        else:
+            game.run()
+        if profiler.enabled and (args.replay or args.headless):
+            print(profiler.report())
+            print(game.assets.report())
+    finally:
+        game.close()
@@ -0,0 +1,62 @@
+class ActivityRegions:
+    def __init__(self, radius=480, margin=64, interval=15, sleep_interval=0):
+        # враги дальше radius от центра камеры спят; проснувшийся засыпает только дальше radius + margin
+        self.radius = radius
+        self.margin = margin
+        self.interval = interval
+        self.sleep_interval = sleep_interval
+        self.source = None
+        self.active = []
+        self.sleeping = []
+        self.awake = set()
+        self.tick = 0
+        self.next_check = 0
+
+    def reset(self):
+        self.source = None
+
+    def refresh(self, entities, center):
+        wake = self.radius * self.radius
+        keep = (self.radius + self.margin) * (self.radius + self.margin)
+        active = []
+        sleeping = []
+        for entity in entities:
+            dx = entity.pos[0] - center[0]
+            dy = entity.pos[1] - center[1]
+            distance = dx * dx + dy * dy
+            if distance <= wake or (distance <= keep and entity in self.awake):
+                active.append(entity)
+            else:
+                sleeping.append(entity)
+
+        # тот же список, если состав не поменялся, чтобы EnemyBatch не перечитывал массивы
+        if active != self.active:
+            self.active = active
+        self.sleeping = sleeping
+        self.awake = set(active)
+        self.source = entities
+        self.next_check = self.tick + self.interval
+
+    def forget(self, removed, entities):
+        self.active = [entity for entity in self.active if entity not in removed]
+        self.sleeping = [entity for entity in self.sleeping if entity not in removed]
+        self.awake.difference_update(removed)
+        self.source = entities
+
+    def visible(self, entities):
+        if entities is self.source:
+            return self.active
+        return entities
+
+    def update(self, entities, center):
+        self.tick += 1
+        if not self.radius:
+            self.active = entities
+            self.source = entities
+            return entities
+        if entities is not self.source or self.tick >= self.next_check:
+            self.refresh(entities, center)
+        if self.sleep_interval and self.sleeping and self.tick % self.sleep_interval == 0:
+            # редкий дешевый тик для спящих
+            return self.active + self.sleeping
+        return self.active
@@ -0,0 +1,149 @@
+import itertools
+import threading
+
+from scripts.utils import get_atlas, load_image, load_images, Animation
+
+# что можно загрузить по имени: (вид, путь[, длительность кадра анимации])
+ASSETS = {
+    'decor': ('images', 'tiles/decor'),
+    'grass': ('images', 'tiles/grass'),
+    'large_decor': ('images', 'tiles/large_decor'),
+    'stone': ('images', 'tiles/stone'),
+    'spawners': ('images', 'tiles/spawners'),
+    'background': ('image', 'background.png'),
+    'bullet': ('alpha_image', 'entities/bullet.png'),
+    'enemy/idle': ('animation', 'entities/enemy/idle', 6),
+    'enemy/run': ('animation', 'entities/enemy/run', 15),
+    'player/idle': ('animation', 'entities/player/idle', 6),
+    'player/run': ('animation', 'entities/player/run', 15),
+    'player/jump': ('animation', 'entities/player/jump', 5),
+    'player/shoot': ('animation', 'entities/player/shoot', 5),
+}
+DEFAULT_BUDGET = 32 << 20
+
+
+def load_asset(spec):
+    kind, path = spec[0], spec[1]
+    if kind == 'images':
+        return load_images(path)
+    if kind == 'image':
+        return load_image(path)
+    if kind == 'alpha_image':
+        return load_image(path, alpha=True)
+    return Animation(load_images(path),
+                     img_dur=spec[2])
+
+
+def surface_bytes(surf):
+    # подповерхность (картинка из атласа) своей памяти не занимает, атлас считается отдельно
+    if surf.get_parent() is not None:
+        return 0
+    return surf.get_pitch() * surf.get_height()
+
+
+def asset_bytes(asset):
+    if isinstance(asset, Animation):
+        return asset_bytes(asset.images) + asset_bytes(asset.flipped_images)
+    if isinstance(asset, list):
+        return sum(surface_bytes(surf) for surf in asset)
+    return surface_bytes(asset)
+
+
+def atlas_bytes(packed):
+    return surface_bytes(packed.surface) + surface_bytes(packed.alpha_surface)
+
+
+class AssetManager:
+    def __init__(self, specs=ASSETS, budget=DEFAULT_BUDGET):
+        self.specs = specs
+        self.budget = budget
+        self.loaded = {}
+        self.sizes = {}
+        self.refs = {}
+        self.used = {}
+        self.clock = itertools.count()
+        self.resident = 0
+        # память атласа: считается один раз при первой загрузке, не выгружается
+        self.atlas_size = None
+        # грузить может и фоновый поток загрузки уровня
+        self.lock = threading.RLock()
+
+    def __getitem__(self, name):
+        asset = self.loaded.get(name)
+        if asset is None:
+            asset = self.load(name)
+        self.used[name] = next(self.clock)
+        return asset
+
+    def __contains__(self, name):
+        return name in self.specs
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    def load(self, name):
+        with self.lock:
+            if name in self.loaded:
+                return self.loaded[name]
+            asset = load_asset(self.specs[name])
+            if self.atlas_size is None:
+                packed = get_atlas()
+                self.atlas_size = atlas_bytes(packed) if packed else 0
+                self.resident += self.atlas_size
+            self.loaded[name] = asset
+            self.sizes[name] = asset_bytes(asset)
+            self.resident += self.sizes[name]
+            self.used[name] = next(self.clock)
+            self.evict()
+            return asset
+
+    def acquire(self, name):
+        # пока на картинки есть ссылки, они не выгружаются; вернуть через release
+        with self.lock:
+            self.refs[name] = self.refs.get(name, 0) + 1
+            return self[name]
+
+    def release(self, name):
+        with self.lock:
+            self.refs[name] -= 1
+            if not self.refs[name]:
+                del self.refs[name]
+            self.evict()
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def evict(self):
+        # сверх бюджета выгружаются давно не нужные картинки, на которые никто не ссылается
+        with self.lock:
+            if self.resident <= self.budget:
+                return
+            unused = sorted((name for name in self.loaded if name not in self.refs),
+                            key=lambda name: self.used[name])
+            for name in unused:
+                if self.resident <= self.budget:
+                    break
+                del self.loaded[name]
+                self.resident -= self.sizes.pop(name)
+
+    def report(self):
+        lines = ['%-16s %4s %10s' % ('asset', 'refs', 'KB')]
+        if self.atlas_size:
+            lines.append('%-16s %4s %10.1f' % ('(atlas)', '-', self.atlas_size / 1024))
+        for name in sorted(self.loaded, key=lambda name: -self.sizes[name]):
+            lines.append('%-16s %4d %10.1f' % (name, self.refs.get(name, 0), self.sizes[name] / 1024))
+        lines.append('resident %.2f MB of %.2f MB budget' % (self.resident / (1 << 20), self.budget / (1 << 20)))
+        return '\n'.join(lines)
+
+
+assets = None
+
+
+def get_assets():
+    # один менеджер на процесс: игра, редактор и анимации берут одни и те же картинки
+    global assets
+    if assets is None:
+        assets = AssetManager()
+    return assets
@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+
+import pygame
+
+from scripts.utils import BASE_IMG_PATH, ATLAS_IMAGE_PATH, ATLAS_INDEX_PATH
+
+ATLAS_DIRS = ['tiles', 'entities']
+ATLAS_WIDTH = 256
+PADDING = 1
+
+
+def collect_images(dirs=ATLAS_DIRS):
+    paths = []
+    for directory in dirs:
+        for root, _, files in os.walk(BASE_IMG_PATH + directory):
+            for name in files:
+                if name.endswith('.png'):
+                    path = os.path.join(root, name)[len(BASE_IMG_PATH):]
+                    paths.append(path.replace(os.sep, '/'))
+    return sorted(paths)
+
+
+def pack(sizes, width=ATLAS_WIDTH):
+    # простая укладка полками: сначала самые высокие
+    order = sorted(sizes, key=lambda path: (-sizes[path][1], path))
+    rects = {}
+    x = y = shelf_height = 0
+    for path in order:
+        w, h = sizes[path]
+        if x + w > width:
+            x = 0
+            y += shelf_height + PADDING
+            shelf_height = 0
+        rects[path] = [x, y, w, h]
+        x += w + PADDING
+        shelf_height = max(shelf_height, h)
+    return rects, y + shelf_height
+
+
+def build_atlas(image_path=ATLAS_IMAGE_PATH, index_path=ATLAS_INDEX_PATH):
+    images = {path: pygame.image.load(BASE_IMG_PATH + path) for path in collect_images()}
+    width = max([ATLAS_WIDTH] + [img.get_width() for img in images.values()])
+    rects, height = pack({path: img.get_size() for path, img in images.items()}, width)
+
+    atlas = pygame.Surface((width, max(height, 1)), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    for path, img in images.items():
+        # BLEND_RGBA_MAX на пустой поверхности копирует пиксели как есть, вместе с прозрачными
+        atlas.blit(img, rects[path][:2], special_flags=pygame.BLEND_RGBA_MAX)
+
+    pygame.image.save(atlas, image_path)
+    with open(index_path, 'w') as f:
+        json.dump({'size': [width, height], 'images': rects}, f, separators=(',', ':'))
+    return len(rects), (width, height)
+
+
+if __name__ == '__main__':
+    count, size = build_atlas(*sys.argv[1:3])
+    print('packed %d images into %dx%d atlas' % (count, size[0], size[1]))
@@ -0,0 +1,196 @@
+from array import array
+
+
+def solid_line(grid, width, height, first, last, across_first, across_last, columns, backwards):
+    # первый по ходу движения столбец (columns) или строка с твердой клеткой среди first..last
+    # в пределах across_first..across_last поперек; -1, если такого нет
+    if columns:
+        limit, across_limit, step, across_step = width, height, 1, width
+    else:
+        limit, across_limit, step, across_step = height, width, width, 1
+    lines = range(last, first - 1, -1) if backwards else range(first, last + 1)
+    for line in lines:
+        if not 0 <= line < limit:
+            continue
+        for across in range(max(across_first, 0), min(across_last, across_limit - 1) + 1):
+            if grid[line * step + across * across_step]:
+                return line
+    return -1
+
+
+class EnemyBatch:
+    def __init__(self):
+        self.entities = None
+        self.count = 0
+
+    def load(self, entities):
+        self.entities = entities
+        self.count = len(entities)
+        self.xs = array('d', [enemy.pos[0] for enemy in entities])
+        self.ys = array('d', [enemy.pos[1] for enemy in entities])
+        self.vxs = array('d', [enemy.velocity[0] for enemy in entities])
+        self.vys = array('d', [enemy.velocity[1] for enemy in entities])
+        self.ws = array('i', [enemy.size[0] for enemy in entities])
+        self.hs = array('i', [enemy.size[1] for enemy in entities])
+        self.flips = bytearray([enemy.flip for enemy in entities])
+        self.walking = array('i', [enemy.walking for enemy in entities])
+        self.moving = bytearray(self.count)
+        # флаги столкновений: 1 - up, 2 - down, 4 - left, 8 - right
+        self.collisions = bytearray(self.count)
+        self.old_collisions = bytearray([enemy.collisions['up']
+                                         | enemy.collisions['down'] << 1
+                                         | enemy.collisions['left'] << 2
+                                         | enemy.collisions['right'] << 3 for enemy in entities])
+
+    def update(self, tilemap, entities, rng):
+        # массивы считаются главными, пока список врагов тот же самый
+        if entities is not self.entities or len(entities) != self.count:
+            self.load(entities)
+
+        origin_x, origin_y, width, height, grid = tilemap.solid_grid()
+        tile_size = tilemap.tile_size
+        xs = self.xs
+        ys = self.ys
+        vxs = self.vxs
+        vys = self.vys
+        ws = self.ws
+        hs = self.hs
+        flips = self.flips
+        walking = self.walking
+        moving = self.moving
+        collisions = self.collisions
+        rand = rng.random
+        randint = rng.randint
+
+        for i in range(self.count):
+            x = xs[i]
+            y = ys[i]
+            w = ws[i]
+            h = hs[i]
+            flip = flips[i]
+
+            move = 0
+            if walking[i]:
+                probe_x = int((int(x) + w // 2 + (-7 if flip else 7)) // tile_size) - origin_x
+                probe_y = int((y + 23) // tile_size) - origin_y
+                if 0 <= probe_x < width and 0 <= probe_y < height and grid[probe_y * width + probe_x]:
+                    move = -0.5 if flip else 0.5
+                else:
+                    flip = not flip
+                walking[i] = max(0, walking[i] - 1)
+            elif rand() < 0.01:
+                walking[i] = randint(30, 120)
+
+            flags = 0
+            frame_x = move + vxs[i]
+            frame_y = vys[i]
+
+            # оси разрешаются прямо по сетке твердости: берется ближайший по ходу движения
+            # столбец (строка) твердых клеток среди тех, что перекрывает враг. враг не больше
+            # клетки перекрывает не больше 2x2 клеток, они проверяются без циклов
+            x += frame_x
+            entity_x = int(x)
+            entity_y = int(y)
+            first_col = entity_x // tile_size - origin_x
+            last_col = (entity_x + w - 1) // tile_size - origin_x
+            first_row = entity_y // tile_size - origin_y
+            last_row = (entity_y + h - 1) // tile_size - origin_y
+            if (last_col - first_col < 2 and last_row - first_row < 2 and first_col >= 0 and first_row >= 0
+                    and last_col < width and last_row < height):
+                top = first_row * width
+                bottom = last_row * width
+                first_solid = grid[top + first_col] or grid[bottom + first_col]
+                last_solid = grid[top + last_col] or grid[bottom + last_col]
+                if frame_x >= 0:
+                    hit = first_col if first_solid else last_col if last_solid else -1
+                else:
+                    hit = last_col if last_solid else first_col if first_solid else -1
+            else:
+                hit = solid_line(grid, width, height, first_col, last_col, first_row, last_row, True, frame_x < 0)
+            if hit >= 0:
+                if frame_x > 0:
+                    x = (hit + origin_x) * tile_size - w
+                    flags |= 8
+                elif frame_x < 0:
+                    x = (hit + origin_x + 1) * tile_size
+                    flags |= 4
+                else:
+                    x = entity_x
+
+            y += frame_y
+            entity_x = int(x)
+            entity_y = int(y)
+            first_col = entity_x // tile_size - origin_x
+            last_col = (entity_x + w - 1) // tile_size - origin_x
+            first_row = entity_y // tile_size - origin_y
+            last_row = (entity_y + h - 1) // tile_size - origin_y
+            if (last_col - first_col < 2 and last_row - first_row < 2 and first_col >= 0 and first_row >= 0
+                    and last_col < width and last_row < height):
+                top = first_row * width
+                bottom = last_row * width
+                first_solid = grid[top + first_col] or grid[top + last_col]
+                last_solid = grid[bottom + first_col] or grid[bottom + last_col]
+                if frame_y >= 0:
+                    hit = first_row if first_solid else last_row if last_solid else -1
+                else:
+                    hit = last_row if last_solid else first_row if first_solid else -1
+            else:
+                hit = solid_line(grid, width, height, first_row, last_row, first_col, last_col, False, frame_y < 0)
+            if hit >= 0:
+                if frame_y > 0:
+                    y = (hit + origin_y) * tile_size - h
+                    flags |= 2
+                elif frame_y < 0:
+                    y = (hit + origin_y + 1) * tile_size
+                    flags |= 1
+                else:
+                    y = entity_y
+
+            if move > 0:
+                flip = False
+            if move < 0:
+                flip = True
+
+            vy = min(5, vys[i] + 0.1)
+            if flags & 3 == 3:
+                vy = 0
+
+            xs[i] = x
+            ys[i] = y
+            vys[i] = vy
+            flips[i] = flip
+            moving[i] = move != 0
+            collisions[i] = flags
+
+        self.write_back()
+
+    def write_back(self):
+        # объекты врагов нужны для отрисовки и пуль: в них переносится только то, что изменилось
+        xs = self.xs
+        ys = self.ys
+        vys = self.vys
+        flips = self.flips
+        walking = self.walking
+        moving = self.moving
+        collisions = self.collisions
+        old_collisions = self.old_collisions
+        for i, enemy in enumerate(self.entities):
+            pos = enemy.pos
+            enemy.prev_pos[0] = pos[0]
+            enemy.prev_pos[1] = pos[1]
+            pos[0] = xs[i]
+            pos[1] = ys[i]
+            enemy.velocity[1] = vys[i]
+            enemy.flip = flips[i] == 1
+            enemy.walking = walking[i]
+            flags = collisions[i]
+            if flags != old_collisions[i]:
+                enemy.collisions['up'] = bool(flags & 1)
+                enemy.collisions['down'] = bool(flags & 2)
+                enemy.collisions['left'] = bool(flags & 4)
+                enemy.collisions['right'] = bool(flags & 8)
+            enemy.animation.update()
+            action = 'run' if moving[i] else 'idle'
+            if action != enemy.action:
+                enemy.set_action(action)
+        old_collisions[:] = collisions
@@ -1,13 +1,15 @@
-import random
 import pygame
 
 
 class PhysicsEntity:
+    __slots__ = ('game', 'type', 'pos', 'prev_pos', 'size', 'velocity', 'collisions',
+                 'action', 'animations', 'animation', 'animation_offset', 'flip', 'entity_rect')
+
     def __init__(self, game, e_type, pos, size):
-        pygame.sprite.Sprite.__init__(self)
         self.game = game
         self.type = e_type
         self.pos = list(pos)
+        self.prev_pos = list(pos)
         self.size = size
         self.velocity = [0, 0]
         self.collisions = {
@@ -18,87 +20,159 @@ class PhysicsEntity:
         }
 
         self.action = ''
+        self.animations = {}
         self.animation_offset = (-3,
                                  -3)
         self.flip = False
+        self.entity_rect = pygame.Rect(0, 0, 0, 0)
         self.set_action('idle')
 
     def rect(self):
-        return pygame.Rect(self.pos[0],
-                           self.pos[1],
-                           self.size[0],
-                           self.size[1])
+        # один и тот же Rect сущности, обновляется при каждом вызове; если нужно сохранить - копируйте
+        self.entity_rect.update(self.pos[0],
+                                self.pos[1],
+                                self.size[0],
+                                self.size[1])
+        return self.entity_rect
 
     def set_action(self, action):
         if action != self.action:
             self.action = action
-            self.animation = self.game.assets[self.type + '/' + self.action].copy()
+            if action not in self.animations:
+                self.animations[action] = self.game.assets[self.type + '/' + self.action].copy()
+            self.animation = self.animations[action]
+            self.animation.reset()
+
+    def snapshot(self):
+        return (tuple(self.pos),
+                tuple(self.velocity),
+                self.flip,
+                self.action,
+                self.size)
+
+    def restore(self, state):
+        pos, velocity, self.flip, action, self.size = state
+        self.pos = list(pos)
+        self.prev_pos = list(pos)
+        self.velocity = list(velocity)
+        self.set_action(action)
 
     def update(self, tilemap, movement=(0, 0)):
-        self.collisions = {
-            'up': False,
-            'down': False,
-            'right': False,
-            'left': False
-        }
-
-        frame_movement = (movement[0] + self.velocity[0],
-                          movement[1] + self.velocity[1])
-
-        self.pos[0] += frame_movement[0]
+        self.move(tilemap, movement[0], movement[1])
+
+    def move(self, tilemap, movement_x, movement_y):
+        pos = self.pos
+        collisions = self.collisions
+        self.prev_pos[0] = pos[0]
+        self.prev_pos[1] = pos[1]
+        collisions['up'] = False
+        collisions['down'] = False
+        collisions['right'] = False
+        collisions['left'] = False
+
+        frame_x = movement_x + self.velocity[0]
+        frame_y = movement_y + self.velocity[1]
+
+        # за тик дальше клетки - поиск первого касания вдоль пути, иначе можно проскочить сквозь стену
+        if abs(frame_x) < tilemap.tile_size:
+            pos[0] += frame_x
+        else:
+            self.sweep(tilemap, frame_x, 0)
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
+        for rect in tilemap.physics_rects_around(pos):
             if entity_rect.colliderect(rect):
-                if frame_movement[0] > 0:
+                if frame_x > 0:
                     entity_rect.right = rect.left
-                    self.collisions['right'] = True
-                if frame_movement[0] < 0:
+                    collisions['right'] = True
+                if frame_x < 0:
                     entity_rect.left = rect.right
-                    self.collisions['left'] = True
-                self.pos[0] = entity_rect.x
+                    collisions['left'] = True
+                pos[0] = entity_rect.x
 
-        self.pos[1] += frame_movement[1]
+        if abs(frame_y) < tilemap.tile_size:
+            pos[1] += frame_y
+        else:
+            self.sweep(tilemap, 0, frame_y)
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
+        for rect in tilemap.physics_rects_around(pos):
             if entity_rect.colliderect(rect):
-                if frame_movement[1] > 0:
+                if frame_y > 0:
                     entity_rect.bottom = rect.top
-                    self.collisions['down'] = True
+                    collisions['down'] = True
 
-                if frame_movement[1] < 0:
+                if frame_y < 0:
                     entity_rect.top = rect.bottom
-                    self.collisions['up'] = True
+                    collisions['up'] = True
 
-                self.pos[1] = entity_rect.y
+                pos[1] = entity_rect.y
 
-        if movement[0] > 0:
+        if movement_x > 0:
             self.flip = False
-        if movement[0] < 0:
+        if movement_x < 0:
             self.flip = True
 
         self.velocity[1] = min(5,
                                self.velocity[1] + 0.1)  # падение
 
-        if self.collisions['down'] and self.collisions['up']:
+        if collisions['down'] and collisions['up']:
             self.velocity[1] = 0
 
         self.animation.update()
 
-    def render(self, surface, offset=(0, 0)):
-        surface.blit(pygame.transform.flip(self.animation.img(),
-                                           self.flip,
-                                           False),
-                     (self.pos[0] - offset[0] + self.animation_offset[0],
-                      self.pos[1] - offset[1] + self.animation_offset[1]))
+    def sweep(self, tilemap, frame_x, frame_y):
+        entity_rect = self.rect()
+        t, normal_x, normal_y = tilemap.sweep(entity_rect.x,
+                                              entity_rect.y,
+                                              entity_rect.width,
+                                              entity_rect.height,
+                                              frame_x,
+                                              frame_y)
+        if normal_x < 0:
+            self.pos[0] = round(entity_rect.right + frame_x * t) - self.size[0]
+            self.collisions['right'] = True
+        elif normal_x > 0:
+            self.pos[0] = round(entity_rect.left + frame_x * t)
+            self.collisions['left'] = True
+        elif normal_y < 0:
+            self.pos[1] = round(entity_rect.bottom + frame_y * t) - self.size[1]
+            self.collisions['down'] = True
+        elif normal_y > 0:
+            self.pos[1] = round(entity_rect.top + frame_y * t)
+            self.collisions['up'] = True
+        else:
+            self.pos[0] += frame_x
+            self.pos[1] += frame_y
+
+    def render_pos(self, alpha=1.0):
+        return (self.prev_pos[0] + (self.pos[0] - self.prev_pos[0]) * alpha,
+                self.prev_pos[1] + (self.pos[1] - self.prev_pos[1]) * alpha)
+
+    def render(self, surface, offset=(0, 0), alpha=1.0):
+        pos = self.render_pos(alpha)
+        surface.blit(self.animation.img(self.flip),
+                     (pos[0] - offset[0] + self.animation_offset[0],
+                      pos[1] - offset[1] + self.animation_offset[1]))
 
 
 class Player(PhysicsEntity):
+    __slots__ = ('air_time', 'jumps', 'is_shooting')
+
     def __init__(self, game, pos, size):
         super().__init__(game, 'player', pos, size)
         self.air_time = 0
         self.jumps = 1
         self.is_shooting = False
 
+    def snapshot(self):
+        return (super().snapshot(),
+                self.air_time,
+                self.jumps,
+                self.is_shooting)
+
+    def restore(self, state):
+        entity_state, self.air_time, self.jumps, self.is_shooting = state
+        super().restore(entity_state)
+
     def update(self, tilemap, movement=(0, 0)):
         super().update(tilemap, movement=movement)
 
@@ -132,32 +206,42 @@ class Player(PhysicsEntity):
 
 
 class Enemy(PhysicsEntity):
+    __slots__ = ('walking',)
+
     def __init__(self, game, pos, size):
         super().__init__(game, 'enemy', pos, size)
 
         self.walking = 0
 
+    def snapshot(self):
+        return (super().snapshot(),
+                self.walking)
+
+    def restore(self, state):
+        entity_state, self.walking = state
+        super().restore(entity_state)
+
     def update(self, tilemap, movement=(0, 0)):
+        movement_x = movement[0]
         if self.walking:
-            if tilemap.solid_check((self.rect().centerx + (-7 if self.flip else 7),
-                                    self.pos[1] + 23)):
-                movement = (movement[0] - 0.5 if self.flip else 0.5,
-                            movement[1])
+            if tilemap.is_solid(int((self.rect().centerx + (-7 if self.flip else 7)) // tilemap.tile_size),
+                                int((self.pos[1] + 23) // tilemap.tile_size)):
+                movement_x = movement_x - 0.5 if self.flip else 0.5
             else:
                 self.flip = not self.flip
             self.walking = max(0,
                                self.walking - 1)
-        elif random.random() < 0.01:
-            self.walking = random.randint(30,
-                                          120)
+        elif self.game.rng.random() < 0.01:
+            self.walking = self.game.rng.randint(30,
+                                                 120)
 
-        super().update(tilemap, movement=movement)
+        self.move(tilemap, movement_x, movement[1])
 
-        if movement[0] != 0:
+        if movement_x != 0:
             self.set_action('run')
 
         else:
             self.set_action('idle')
 
-    def render(self, surface, offset=(0, 0)):
-        super().render(surface, offset=offset)
+    def render(self, surface, offset=(0, 0), alpha=1.0):
+        super().render(surface, offset=offset, alpha=alpha)
@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+
+from scripts.tilemap import EMPTY, save_map
+
+# журнал правок редактора: по строке JSON на правку, дописывается в конец файла.
+# строка - [вид, изменения], вид 'e' - правка, 'u' - отмена, 'r' - повтор.
+# изменение тайла ['t', [x, y], было, стало], где было/стало - [тип, вариант] или None;
+# изменение тайла вне сетки ['o', тайл, был, стал], где был/стал - есть ли тайл на карте
+JOURNAL_EXTENSION = '.journal'
+COMPACTING_EXTENSION = '.compacting'
+COMPACT_EVERY = 500
+
+
+class EditJournal:
+    def __init__(self, tilemap, path, compact_every=COMPACT_EVERY):
+        self.tilemap = tilemap
+        self.path = path
+        self.journal_path = path + JOURNAL_EXTENSION
+        self.compacting_path = self.journal_path + COMPACTING_EXTENSION
+        self.compact_every = compact_every
+        self.undo_stack = []
+        self.redo_stack = []
+        self.pending = []
+        self.records = 0
+        self.worker = None
+
+        # незавершенное сжатие и записи после него накатываются поверх карты по порядку
+        for journal_path in (self.compacting_path, self.journal_path):
+            if os.path.exists(journal_path):
+                self.replay(journal_path)
+        self.file = open(self.journal_path, 'a')
+
+    def replay(self, journal_path):
+        valid = 0
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    kind, changes = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid += len(line)
+                if kind == 'u':
+                    self.apply(changes, undo=True)
+                    if self.undo_stack:
+                        self.undo_stack.pop()
+                    self.redo_stack.append(changes)
+                else:
+                    self.apply(changes)
+                    if kind == 'r' and self.redo_stack:
+                        self.redo_stack.pop()
+                    elif kind == 'e':
+                        self.redo_stack = []
+                    self.undo_stack.append(changes)
+                self.records += 1
+        # оборванная при падении последняя строка отрезается, чтобы новые записи не склеились с ней
+        if valid != os.path.getsize(journal_path):
+            os.truncate(journal_path, valid)
+
+    def tile_state(self, x, y):
+        type_id, variant = self.tilemap.get_id(x, y)
+        if type_id == EMPTY:
+            return None
+        return [self.tilemap.tile_types[type_id], variant]
+
+    def set_state(self, x, y, state):
+        if state is None:
+            self.tilemap.remove_tile(x, y)
+        else:
+            self.tilemap.set_tile(x, y, state[0], state[1])
+
+    def has_offgrid(self, tile):
+        return any(other == tile for other in self.tilemap.offgrid_at(tile['pos']))
+
+    def apply(self, changes, undo=False):
+        # повторное применение безопасно: тайлы ставятся в состояние, а не меняются на величину
+        for change in (reversed(changes) if undo else changes):
+            state = change[2] if undo else change[3]
+            if change[0] == 't':
+                self.set_state(change[1][0], change[1][1], state)
+            elif state and not self.has_offgrid(change[1]):
+                self.tilemap.add_offgrid(change[1])
+            elif not state:
+                for tile in self.tilemap.offgrid_at(change[1]['pos']):
+                    if tile == change[1]:
+                        self.tilemap.remove_offgrid(tile)
+                        break
+
+    def write(self, kind, changes):
+        self.pending.append(json.dumps([kind, changes], separators=(',', ':')))
+        self.records += 1
+
+    def edit(self, changes):
+        if not changes:
+            return False
+        self.undo_stack.append(changes)
+        self.redo_stack = []
+        self.write('e', changes)
+        return True
+
+    def cells_around(self, x, y, autotile):
+        if autotile:
+            return [(x, y), (x + 1, y), (x - 1, y), (x, y - 1), (x, y + 1)]
+        return [(x, y)]
+
+    def tile_changes(self, cells, before):
+        changes = []
+        for x, y in cells:
+            after = self.tile_state(x, y)
+            if after != before[(x, y)]:
+                changes.append(['t', [x, y], before[(x, y)], after])
+        return changes
+
+    def place(self, x, y, tile_type, variant, autotile=False):
+        state = self.tile_state(x, y)
+        # клетка уже такая, как нужно: ничего не меняется и не пишется
+        if state is not None and state[0] == tile_type and (autotile or state[1] == variant):
+            return False
+        cells = self.cells_around(x, y, autotile)
+        before = {cell: self.tile_state(cell[0], cell[1]) for cell in cells}
+        self.tilemap.set_tile(x, y, tile_type, variant)
+        if autotile:
+            self.tilemap.autotile_around(x, y)
+        return self.edit(self.tile_changes(cells, before))
+
+    def remove(self, x, y, autotile=False):
+        if self.tile_state(x, y) is None:
+            return False
+        cells = self.cells_around(x, y, autotile)
+        before = {cell: self.tile_state(cell[0], cell[1]) for cell in cells}
+        self.tilemap.remove_tile(x, y)
+        if autotile:
+            self.tilemap.autotile_around(x, y)
+        return self.edit(self.tile_changes(cells, before))
+
+    def autotile(self):
+        changes = [['t', [x, y], [tile_type, before], [tile_type, after]]
+                   for x, y, tile_type, before, after in self.tilemap.autotile()]
+        return self.edit(changes)
+
+    def add_offgrid(self, tile):
+        tile = {
+            'type': tile['type'],
+            'variant': tile['variant'],
+            'pos': list(tile['pos'])
+        }
+        self.tilemap.add_offgrid(tile)
+        return self.edit([['o', tile, False, True]])
+
+    def remove_offgrid(self, tile):
+        self.tilemap.remove_offgrid(tile)
+        return self.edit([['o', tile, True, False]])
+
+    def undo(self):
+        if not self.undo_stack:
+            return False
+        changes = self.undo_stack.pop()
+        self.apply(changes, undo=True)
+        self.redo_stack.append(changes)
+        self.write('u', changes)
+        return True
+
+    def redo(self):
+        if not self.redo_stack:
+            return False
+        changes = self.redo_stack.pop()
+        self.apply(changes)
+        self.undo_stack.append(changes)
+        self.write('r', changes)
+        return True
+
+    def flush(self):
+        # раз в кадр: накопленные строки дописываются одним write
+        if self.pending:
+            self.file.write('\n'.join(self.pending) + '\n')
+            self.file.flush()
+            self.pending = []
+        if self.records >= self.compact_every:
+            self.compact()
+
+    def compact(self, wait=False):
+        # снимок карты берется здесь, запись полной карты идет в фоновом потоке;
+        # новые правки тем временем пишутся в свежий журнал
+        if self.worker is not None and self.worker.is_alive():
+            if not wait:
+                return False
+            self.worker.join()
+        if not self.records and not self.pending and not os.path.exists(self.compacting_path):
+            # правок после прошлого сжатия нет - карта на диске уже актуальна
+            return False
+        if self.pending:
+            self.file.write('\n'.join(self.pending) + '\n')
+            self.pending = []
+        self.file.close()
+        if self.tilemap.map_file is not None:
+            # карта читается из .map по чанкам: в файл дописываются только измененные чанки,
+            # это быстро и делается сразу, без снимка всей карты
+            self.tilemap.write_back()
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+            self.file = open(self.journal_path, 'w')
+            self.records = 0
+            return True
+        if os.path.exists(self.compacting_path):
+            # прошлое сжатие не дописалось: его записи переносятся в начало текущего журнала
+            with open(self.compacting_path, 'r') as old, open(self.journal_path, 'r') as new:
+                data = old.read() + new.read()
+            with open(self.journal_path, 'w') as f:
+                f.write(data)
+        os.replace(self.journal_path, self.compacting_path)
+        self.file = open(self.journal_path, 'a')
+        self.records = 0
+
+        tiles = list(self.tilemap.tiles())
+        offgrid = [tile.copy() for tile in self.tilemap.offgrid_tiles]
+        self.worker = threading.Thread(target=self.write_map,
+                                       args=(self.tilemap.tile_size, tiles, offgrid))
+        self.worker.start()
+        if wait:
+            self.worker.join()
+        return True
+
+    def write_map(self, tile_size, tiles, offgrid):
+        save_map(self.path, tile_size, tiles, offgrid)
+        os.remove(self.compacting_path)
+
+    def close(self):
+        self.compact(wait=True)
+        self.file.close()
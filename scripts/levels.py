@@ -0,0 +1,103 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from scripts.mapformat import MAP_EXTENSION, is_binary_map
+from scripts.tilemap import Tilemap
+
+SPAWNER_TILES = [('spawners', 0),
+                 ('spawners', 1)]
+# json больше этого размера при фоновой загрузке переводится в .map в отдельном процессе
+CONVERT_SIZE = 1 << 20
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Level:
+    def __init__(self, map_id, tilemap, spawners, asset_names):
+        self.map_id = map_id
+        # карта уровня во время игры не меняется, поэтому ее можно использовать повторно
+        self.tilemap = tilemap
+        self.spawners = spawners
+        # картинки тайлов, которые нужны для отрисовки уровня
+        self.asset_names = asset_names
+        self.start = None
+
+
+class LevelCache:
+    def __init__(self, game, tile_size=16):
+        self.game = game
+        self.tile_size = tile_size
+        self.levels = {}
+        self.workers = {}
+        self.convert_dir = None
+
+    def load(self, map_id, path=None):
+        tilemap = Tilemap(self.game,
+                          tile_size=self.tile_size)
+        tilemap.load(path if path is not None else self.game.level_path(map_id))
+        spawners = tuple((spawner['variant'], tuple(spawner['pos']))
+                         for spawner in tilemap.extract(SPAWNER_TILES))
+        asset_names = set(tilemap.tile_types)
+        asset_names.update(tile['type'] for tile in tilemap.offgrid_tiles)
+        return Level(map_id, tilemap, spawners, tuple(sorted(asset_names)))
+
+    def preload(self, map_id):
+        # следующий уровень готовится в фоновом потоке, пока играется текущий;
+        # поток собирает только новый Tilemap, к состоянию игры он не прикасается
+        if map_id in self.levels or map_id in self.workers:
+            return False
+        if not os.path.exists(self.game.level_path(map_id)):
+            return False
+        worker = threading.Thread(target=self.load_in_background,
+                                  args=(map_id,),
+                                  daemon=True)
+        self.workers[map_id] = worker
+        worker.start()
+        return True
+
+    def convert(self, path, map_id):
+        # json.load держит GIL все время разбора, и игра стояла бы так же, как без фоновой загрузки;
+        # разбор идет в отдельном процессе, а поток только ждет его и читает готовый .map
+        if self.convert_dir is None:
+            self.convert_dir = tempfile.mkdtemp(prefix='space_sentinel_levels_')
+        map_path = os.path.join(self.convert_dir, str(map_id) + MAP_EXTENSION)
+        subprocess.run([sys.executable, '-m', 'scripts.mapformat', path, map_path],
+                       cwd=ROOT,
+                       check=True)
+        return map_path
+
+    def load_in_background(self, map_id):
+        try:
+            path = self.game.level_path(map_id)
+            if not is_binary_map(path) and os.path.getsize(path) >= CONVERT_SIZE:
+                path = self.convert(path, map_id)
+            self.levels[map_id] = self.load(map_id, path)
+        except Exception:
+            # ошибка загрузки всплывет в get: там уровень будет загружен заново в основном потоке
+            pass
+
+    def get(self, map_id):
+        worker = self.workers.pop(map_id, None)
+        if worker is not None:
+            worker.join()
+        if map_id not in self.levels:
+            self.levels[map_id] = self.load(map_id)
+        return self.levels[map_id]
+
+    def clear(self):
+        for worker in self.workers.values():
+            worker.join()
+        self.workers = {}
+        self.levels = {}
+
+    def close(self):
+        # отображенные в память .map закрываются до удаления временных файлов
+        for level in self.levels.values():
+            level.tilemap.close_map_file()
+        self.clear()
+        if self.convert_dir is not None:
+            shutil.rmtree(self.convert_dir, ignore_errors=True)
+            self.convert_dir = None
@@ -0,0 +1,233 @@
+import json
+import mmap
+import os
+import struct
+import sys
+
+# бинарный формат карты:
+#   заголовок | таблица типов | данные чанков | таблица чанков | тайлы вне сетки
+# данные каждого чанка - подряд идущие записи тайлов, таблица чанков хранит их смещения
+MAGIC = b'SSMP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHIIQQQ')
+TYPE_LENGTH = struct.Struct('<B')
+CHUNK_ENTRY = struct.Struct('<iiQIQ')
+TILE_RECORD = struct.Struct('<BBHH')
+OFFGRID_RECORD = struct.Struct('<ddHH')
+ALL_TYPES = (1 << 64) - 1
+MAP_EXTENSION = '.map'
+
+
+def is_binary_map(path):
+    return path.endswith(MAP_EXTENSION)
+
+
+def type_mask(type_ids):
+    mask = 0
+    for type_id in type_ids:
+        if type_id >= 64:
+            return ALL_TYPES
+        mask |= 1 << type_id
+    return mask
+
+
+def write_map(path, tile_size, chunk_size, tiles, offgrid):
+    tile_types = []
+    type_ids = {}
+
+    def type_id(tile_type):
+        if tile_type not in type_ids:
+            type_ids[tile_type] = len(tile_types)
+            tile_types.append(tile_type)
+        return type_ids[tile_type]
+
+    chunks = {}
+    for x, y, tile_type, variant in tiles:
+        key = (x // chunk_size, y // chunk_size)
+        if key not in chunks:
+            chunks[key] = []
+        chunks[key].append((x - key[0] * chunk_size,
+                            y - key[1] * chunk_size,
+                            type_id(tile_type),
+                            variant))
+    offgrid_records = [(tile['pos'][0], tile['pos'][1], type_id(tile['type']), tile['variant'])
+                       for tile in offgrid]
+
+    types_data = b''.join(TYPE_LENGTH.pack(len(name.encode())) + name.encode() for name in tile_types)
+    types_offset = HEADER.size
+
+    offset = types_offset + len(types_data)
+    chunk_data = []
+    table = []
+    for key in sorted(chunks):
+        records = chunks[key]
+        data = b''.join(TILE_RECORD.pack(*record) for record in records)
+        table.append(CHUNK_ENTRY.pack(key[0], key[1], offset, len(records),
+                                      type_mask({record[2] for record in records})))
+        chunk_data.append(data)
+        offset += len(data)
+
+    table_offset = offset
+    offgrid_offset = table_offset + CHUNK_ENTRY.size * len(table)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, tile_size, chunk_size, len(tile_types),
+                            len(table), len(offgrid_records),
+                            types_offset, table_offset, offgrid_offset))
+        f.write(types_data)
+        for data in chunk_data:
+            f.write(data)
+        for entry in table:
+            f.write(entry)
+        for record in offgrid_records:
+            f.write(OFFGRID_RECORD.pack(*record))
+    os.replace(tmp_path, path)
+
+
+class MapFile:
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        self.file = open(self.path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.tile_size, self.chunk_size, type_count, chunk_count,
+         self.offgrid_count, self.types_offset, table_offset, self.offgrid_offset) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('not a Space Sentinel map: ' + self.path)
+
+        self.tile_types = []
+        offset = self.types_offset
+        for _ in range(type_count):
+            length = TYPE_LENGTH.unpack_from(self.data, offset)[0]
+            self.tile_types.append(bytes(self.data[offset + 1:offset + 1 + length]).decode())
+            offset += 1 + length
+
+        self.chunks = {}
+        for cx, cy, offset, count, mask in CHUNK_ENTRY.iter_unpack(
+                self.data[table_offset:table_offset + CHUNK_ENTRY.size * chunk_count]):
+            self.chunks[(cx, cy)] = (offset, count, mask)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def append(self, tile_types, chunks, offgrid=None):
+        # измененные чанки дописываются в конец файла вместе с новой таблицей чанков,
+        # затем перезаписывается заголовок; до записи заголовка файл остается прежней картой.
+        # chunks - {ключ: записи тайлов}, пустой список удаляет чанк; offgrid - записи или None
+        table = dict(self.chunks)
+        with open(self.path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            types_offset = self.types_offset
+            if tile_types != self.tile_types:
+                types_offset = f.tell()
+                f.write(b''.join(TYPE_LENGTH.pack(len(name.encode())) + name.encode() for name in tile_types))
+
+            for key, records in chunks.items():
+                if not records:
+                    table.pop(key, None)
+                    continue
+                table[key] = (f.tell(), len(records), type_mask({record[2] for record in records}))
+                f.write(b''.join(TILE_RECORD.pack(*record) for record in records))
+
+            table_offset = f.tell()
+            for key in sorted(table):
+                f.write(CHUNK_ENTRY.pack(key[0], key[1], *table[key]))
+
+            offgrid_count = self.offgrid_count
+            offgrid_offset = self.offgrid_offset
+            if offgrid is not None:
+                offgrid_count = len(offgrid)
+                offgrid_offset = f.tell()
+                for record in offgrid:
+                    f.write(OFFGRID_RECORD.pack(*record))
+
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, self.tile_size, self.chunk_size, len(tile_types),
+                                len(table), offgrid_count,
+                                types_offset, table_offset, offgrid_offset))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # файл вырос, отображение открывается заново
+        self.close()
+        self.open()
+
+    def chunk_records(self, key):
+        offset, count, mask = self.chunks[key]
+        return TILE_RECORD.iter_unpack(self.data[offset:offset + TILE_RECORD.size * count])
+
+    def offgrid(self):
+        tiles = []
+        end = self.offgrid_offset + OFFGRID_RECORD.size * self.offgrid_count
+        for x, y, type_id, variant in OFFGRID_RECORD.iter_unpack(self.data[self.offgrid_offset:end]):
+            tiles.append({
+                'type': self.tile_types[type_id],
+                'variant': variant,
+                'pos': [x, y]
+            })
+        return tiles
+
+    def tiles(self):
+        for key in self.chunks:
+            for x, y, type_id, variant in self.chunk_records(key):
+                yield (key[0] * self.chunk_size + x,
+                       key[1] * self.chunk_size + y,
+                       self.tile_types[type_id],
+                       variant)
+
+
+def json_to_binary(src, dst, chunk_size=16):
+    with open(src, 'r') as f:
+        map_data = json.load(f)
+    tiles = [(tile['pos'][0], tile['pos'][1], tile['type'], tile['variant'])
+             for tile in map_data['tilemap'].values()]
+    write_map(dst, map_data['tile_size'], chunk_size, tiles, map_data['offgrid'])
+
+
+def binary_to_json(src, dst):
+    map_file = MapFile(src)
+    tilemap = {}
+    for x, y, tile_type, variant in map_file.tiles():
+        tilemap[str(x) + ';' + str(y)] = {
+            'type': tile_type,
+            'variant': variant,
+            'pos': [x, y]
+        }
+    map_data = {
+        'tilemap': tilemap,
+        'tile_size': map_file.tile_size,
+        'offgrid': map_file.offgrid()
+    }
+    map_file.close()
+    with open(dst, 'w') as f:
+        json.dump(map_data, f)
+
+
+def repack_map(src, dst, chunk_size=16):
+    # после дописываний редактора в файле остаются старые копии чанков, перепаковка их убирает
+    map_file = MapFile(src)
+    tiles = list(map_file.tiles())
+    offgrid = map_file.offgrid()
+    tile_size = map_file.tile_size
+    map_file.close()
+    write_map(dst, tile_size, chunk_size, tiles, offgrid)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python -m scripts.mapformat <src.json|src.map> <dst.map|dst.json>')
+        sys.exit(1)
+    if is_binary_map(sys.argv[1]) and is_binary_map(sys.argv[2]):
+        repack_map(sys.argv[1], sys.argv[2])
+    elif is_binary_map(sys.argv[1]):
+        binary_to_json(sys.argv[1], sys.argv[2])
+    else:
+        json_to_binary(sys.argv[1], sys.argv[2])
@@ -0,0 +1,71 @@
+import pygame
+
+# в режиме dirty кадр сравнивается с прошлым полосами по BAND_HEIGHT строк,
+# на экран переносятся и обновляются только изменившиеся полосы
+BAND_HEIGHT = 16
+
+
+class Presenter:
+    def __init__(self, screen, display, dirty=False, band_height=BAND_HEIGHT):
+        self.screen = screen
+        self.display = display
+        self.dirty = dirty
+        self.size = screen.get_size()
+        pitch = display.get_pitch()
+        width, height = display.get_size()
+        # пиксели сравниваются словами по 8 байт (по 4, если полоса не делится на 8):
+        # сравнение memoryview по байтам в десятки раз медленнее
+        self.word = 'Q' if pitch * band_height % 8 == 0 and pitch * height % 8 == 0 else 'I'
+        word_size = 8 if self.word == 'Q' else 4
+        self.band_words = pitch * band_height // word_size
+        # прошлый кадр хранится в одном буфере, который не пересоздается
+        self.previous = bytearray(pitch * height)
+        self.previous_words = memoryview(self.previous).cast(self.word)
+        self.bands = []
+        for y in range(0, height, band_height):
+            band = pygame.Rect(0, y, width, min(band_height, height - y))
+            top = y * self.size[1] // height
+            bottom = band.bottom * self.size[1] // height
+            dest = pygame.Rect(0, top, self.size[0], bottom - top)
+            if dest.height:
+                # увеличенная полоса пишется прямо в экран, без нового Surface на кадр
+                self.bands.append((y * pitch // word_size,
+                                   display.subsurface(band),
+                                   dest,
+                                   screen.subsurface(dest)))
+        self.full = True
+
+    def present(self, overlay=None, full=False):
+        # overlay(screen) рисует поверх увеличенной картинки (таблица профайлера);
+        # пока он виден и кадром позже кадр переносится целиком
+        if not self.dirty or full or self.full:
+            pygame.transform.scale(self.display, self.size, self.screen)
+            if overlay is not None:
+                overlay(self.screen)
+            pygame.display.update()
+            if self.dirty:
+                # view блокирует display, поэтому отпускается сразу
+                with memoryview(self.display.get_view('1')) as view, view.cast('B') as pixels:
+                    self.previous[:] = pixels
+            self.full = full
+            return
+
+        previous = self.previous_words
+        step = self.band_words
+        rects = []
+        with memoryview(self.display.get_view('1')) as view, view.cast('B') as pixels, \
+                pixels.cast(self.word) as current:
+            for start, band, dest, target in self.bands:
+                if current[start:start + step] != previous[start:start + step]:
+                    previous[start:start + step] = current[start:start + step]
+                    rects.append((band, dest, target))
+        for band, dest, target in rects:
+            pygame.transform.scale(band, dest.size, target)
+        if overlay is not None:
+            overlay(self.screen)
+        if rects:
+            pygame.display.update([dest for band, dest, target in rects])
+
+    def invalidate(self):
+        # экран перерисован мимо Presenter (заставка, меню): следующий кадр целиком
+        self.full = True
@@ -0,0 +1,122 @@
+import csv
+import json
+from collections import deque
+from time import perf_counter_ns
+
+import pygame
+
+OVERLAY_REFRESH = 15
+
+
+class Profiler:
+    def __init__(self, enabled=False, window=300, out_path=None):
+        # выключенный профайлер - одна проверка флага на вызов, ничего не замеряется и не хранится
+        self.enabled = enabled or out_path is not None
+        self.window = window
+        self.out_path = out_path
+        self.samples = {}
+        self.current = {}
+        self.starts = {}
+        self.frame = 0
+        self.frame_start = 0
+        # полная трасса (кадр, фаза, начало, длительность) копится только для экспорта
+        self.trace = [] if out_path is not None else None
+        self.overlay = False
+        self.font = None
+        self.lines = []
+
+    def begin(self, name):
+        if self.enabled:
+            self.starts[name] = perf_counter_ns()
+
+    def end(self, name):
+        if not self.enabled:
+            return
+        now = perf_counter_ns()
+        start = self.starts.pop(name)
+        self.current[name] = self.current.get(name, 0) + now - start
+        if self.trace is not None:
+            self.trace.append((self.frame, name, start, now - start))
+
+    def begin_frame(self):
+        if self.enabled:
+            self.frame_start = perf_counter_ns()
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        now = perf_counter_ns()
+        self.current['frame'] = now - self.frame_start
+        if self.trace is not None:
+            self.trace.append((self.frame, 'frame', self.frame_start, now - self.frame_start))
+        for name in self.current:
+            if name not in self.samples:
+                self.samples[name] = deque([0] * min(self.frame, self.window), maxlen=self.window)
+        # фаза, которой не было в кадре (например, ни одного тика симуляции), считается за 0
+        for name, samples in self.samples.items():
+            samples.append(self.current.get(name, 0))
+        self.current = {}
+        self.frame += 1
+
+    def stats(self):
+        # (фаза, p50, p95, p99, max) в миллисекундах по последним window кадрам
+        rows = []
+        for name, samples in self.samples.items():
+            data = sorted(samples)
+            last = len(data) - 1
+            rows.append((name,
+                         data[last // 2] / 1e6,
+                         data[last * 95 // 100] / 1e6,
+                         data[last * 99 // 100] / 1e6,
+                         data[last] / 1e6))
+        rows.sort(key=lambda row: -row[2])
+        return rows
+
+    def report(self):
+        lines = ['%-16s %8s %8s %8s %8s' % ('phase, ms', 'p50', 'p95', 'p99', 'max')]
+        for row in self.stats():
+            lines.append('%-16s %8.3f %8.3f %8.3f %8.3f' % row)
+        return '\n'.join(lines)
+
+    def toggle_overlay(self):
+        if self.enabled:
+            self.overlay = not self.overlay
+
+    def draw(self, surf):
+        if not (self.enabled and self.overlay):
+            return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 18)
+        # текст перерисовывается раз в OVERLAY_REFRESH кадров, а не каждый кадр
+        if self.frame % OVERLAY_REFRESH == 0 or not self.lines:
+            self.lines = [self.font.render(line, True, (255, 255, 255), (0, 0, 0))
+                          for line in self.report().split('\n')]
+        y = 4
+        for line in self.lines:
+            surf.blit(line, (4, y))
+            y += line.get_height()
+
+    def export(self, path):
+        if path.endswith('.json'):
+            # формат Chrome trace: chrome://tracing или ui.perfetto.dev
+            events = [{
+                'name': name,
+                'ph': 'X',
+                'ts': start / 1000,
+                'dur': duration / 1000,
+                'pid': 0,
+                'tid': 0,
+                'args': {'frame': frame}
+            } for frame, name, start, duration in self.trace]
+            with open(path, 'w') as f:
+                json.dump({'traceEvents': events}, f)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame', 'phase', 'start_us', 'duration_us'])
+                for frame, name, start, duration in self.trace:
+                    writer.writerow([frame, name, start / 1000, duration / 1000])
+
+    def close(self):
+        if self.out_path is not None and self.trace:
+            self.export(self.out_path)
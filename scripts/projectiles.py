@@ -0,0 +1,117 @@
+from array import array
+
+import pygame
+
+
+class Projectiles:
+    def __init__(self, size, capacity=64, speed=3):
+        self.size = size
+        self.speed = speed
+        self.capacity = 0
+        self.xs = array('d')
+        self.ys = array('d')
+        self.dirs = array('b')
+        self.alive = bytearray()
+        self.free = []
+        self.high = 0
+        self.count = 0
+        self.scratch_rect = pygame.Rect(0, 0, size[0], size[1])
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        # слоты только добавляются, освобожденные используются повторно
+        extra = capacity - self.capacity
+        self.xs.extend(array('d', bytes(8 * extra)))
+        self.ys.extend(array('d', bytes(8 * extra)))
+        self.dirs.extend(array('b', bytes(extra)))
+        self.alive.extend(bytes(extra))
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        for i in range(self.high):
+            self.alive[i] = 0
+        self.free = list(range(self.capacity - 1, -1, -1))
+        self.high = 0
+        self.count = 0
+
+    def spawn(self, x, y, direction):
+        if not self.free:
+            self.grow(self.capacity * 2)
+        i = self.free.pop()
+        self.xs[i] = x
+        self.ys[i] = y
+        self.dirs[i] = direction
+        self.alive[i] = 1
+        self.count += 1
+        if i >= self.high:
+            self.high = i + 1
+        return i
+
+    def kill(self, i):
+        if not self.alive[i]:
+            return
+        self.alive[i] = 0
+        self.free.append(i)
+        self.count -= 1
+        while self.high and not self.alive[self.high - 1]:
+            self.high -= 1
+
+    def active(self):
+        alive = self.alive
+        return [i for i in range(self.high) if alive[i]]
+
+    def rect(self, i):
+        rect = self.scratch_rect
+        rect.x = int(self.xs[i])
+        rect.y = int(self.ys[i])
+        return rect
+
+    def update(self, tilemap):
+        left, top, width, height = tilemap.bounds()
+        right = left + width
+        bottom = top + height
+        half_w = self.size[0] / 2
+        half_h = self.size[1] / 2
+        tile_size = tilemap.tile_size
+        is_solid = tilemap.is_solid
+        xs = self.xs
+        ys = self.ys
+        dirs = self.dirs
+        alive = self.alive
+        speed = self.speed
+
+        for i in range(self.high):
+            if not alive[i]:
+                continue
+            step = speed * dirs[i]
+            x = xs[i] + step
+            xs[i] = x
+            center_x = x + half_w
+            center_y = ys[i] + half_h
+            if (center_x < left or center_x >= right or center_y < top or center_y >= bottom
+                    or is_solid(int(center_x // tile_size), int(center_y // tile_size))):
+                self.kill(i)
+            elif abs(step) >= tile_size and tilemap.sweep(center_x - step, center_y, 0, 0, step, 0)[0] < 1:
+                # быстрая пуля могла пролететь стену между прошлой и новой позицией
+                self.kill(i)
+
+    def snapshot(self):
+        return tuple((self.xs[i], self.ys[i], self.dirs[i]) for i in self.active())
+
+    def restore(self, state):
+        self.clear()
+        for x, y, direction in state:
+            self.spawn(x, y, direction)
+
+    def render(self, surf, images, offset=(0, 0), alpha=1.0):
+        back = self.speed * (1 - alpha)
+        for i in range(self.high):
+            if self.alive[i]:
+                direction = self.dirs[i]
+                surf.blit(images[direction],
+                          (self.xs[i] - back * direction - offset[0],
+                           self.ys[i] - offset[1]))
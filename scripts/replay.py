@@ -0,0 +1,86 @@
+import struct
+
+# запись ввода: заголовок (seed, уровень, радиус активности, тиков) и серии (значение, сколько тиков подряд).
+# значение - биты нажатых клавиш на тике или RESTART | уровень, если игрок перезапустил уровень
+MAGIC = b'SSIR'
+VERSION = 2
+HEADER = struct.Struct('<4sHIiiI')
+RUN = struct.Struct('<BH')
+# seed хранится в заголовке как беззнаковое 32-битное число
+SEED_LIMIT = 1 << 32
+INPUT_BITS = {
+    'left': 1,
+    'right': 2,
+    'jump': 4,
+    'shoot': 8
+}
+RESTART = 0x80
+MAX_RUN = 0xFFFF
+
+
+def pack_inputs(inputs):
+    bits = 0
+    for name, bit in INPUT_BITS.items():
+        if inputs[name]:
+            bits |= bit
+    return bits
+
+
+def unpack_inputs(bits):
+    return {name: bool(bits & bit) for name, bit in INPUT_BITS.items()}
+
+
+class InputRecorder:
+    def __init__(self, path, seed, level, activity_radius):
+        # проверка сразу, а не при записи в close(), иначе вся сессия теряется на выходе
+        if not 0 <= seed < SEED_LIMIT:
+            raise ValueError('seed does not fit in a recording: %d' % seed)
+        self.path = path
+        self.seed = seed
+        self.level = level
+        # от радиуса зависит, какие враги обновляются, без него повтор расходится с записью
+        self.activity_radius = activity_radius
+        self.runs = []
+        self.ticks = 0
+
+    def add(self, value):
+        if self.runs and self.runs[-1][0] == value and self.runs[-1][1] < MAX_RUN:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([value, 1])
+
+    def record(self, inputs):
+        self.add(pack_inputs(inputs))
+        self.ticks += 1
+
+    def restart(self, level):
+        self.add(RESTART | level)
+
+    def close(self):
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.seed, self.level, self.activity_radius, self.ticks))
+            for value, count in self.runs:
+                f.write(RUN.pack(value, count))
+
+
+class Recording:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError('not a Space Sentinel input recording: ' + path)
+        magic, version, self.seed, self.level, self.activity_radius, self.ticks = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a Space Sentinel input recording: ' + path)
+        self.runs = list(RUN.iter_unpack(data[HEADER.size:]))
+
+    def events(self):
+        # ('tick', ввод) на каждый тик и ('restart', уровень) на перезапуск
+        for value, count in self.runs:
+            if value & RESTART:
+                for _ in range(count):
+                    yield 'restart', value & ~RESTART
+            else:
+                inputs = unpack_inputs(value)
+                for _ in range(count):
+                    yield 'tick', inputs
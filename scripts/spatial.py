@@ -0,0 +1,136 @@
+import math
+
+
+class SpatialGrid:
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.items = {}
+        self.counter = 0
+
+    def cell_keys(self, rect):
+        size = self.cell_size
+        keys = []
+        for cx in range(math.floor(rect[0]) // size,
+                        math.floor(rect[0] + rect[2]) // size + 1):
+            for cy in range(math.floor(rect[1]) // size,
+                            math.floor(rect[1] + rect[3]) // size + 1):
+                keys.append((cx, cy))
+        return keys
+
+    def clear(self):
+        self.cells = {}
+        self.items = {}
+
+    def insert(self, item, rect):
+        keys = self.cell_keys(rect)
+        self.items[id(item)] = (self.counter, item, tuple(rect), keys)
+        self.counter += 1
+        for key in keys:
+            if key not in self.cells:
+                self.cells[key] = {}
+            self.cells[key][id(item)] = item
+
+    def remove(self, item):
+        entry = self.items.pop(id(item), None)
+        if entry is None:
+            return
+        for key in entry[3]:
+            cell = self.cells[key]
+            del cell[id(item)]
+            if not cell:
+                del self.cells[key]
+
+    def query(self, rect):
+        found = {}
+        for key in self.cell_keys(rect):
+            cell = self.cells.get(key)
+            if cell:
+                found.update(cell)
+
+        matches = []
+        for item_id in found:
+            order, item, item_rect, keys = self.items[item_id]
+            if (item_rect[0] < rect[0] + rect[2] and rect[0] < item_rect[0] + item_rect[2]
+                    and item_rect[1] < rect[1] + rect[3] and rect[1] < item_rect[1] + item_rect[3]):
+                matches.append((order, item))
+        matches.sort(key=lambda match: match[0])
+        return [item for order, item in matches]
+
+    def query_point(self, pos):
+        cell = self.cells.get((math.floor(pos[0]) // self.cell_size,
+                               math.floor(pos[1]) // self.cell_size))
+        if not cell:
+            return []
+
+        matches = []
+        for item_id in cell:
+            order, item, item_rect, keys = self.items[item_id]
+            if (item_rect[0] <= pos[0] < item_rect[0] + item_rect[2]
+                    and item_rect[1] <= pos[1] < item_rect[1] + item_rect[3]):
+                matches.append((order, item))
+        matches.sort(key=lambda match: match[0])
+        return [item for order, item in matches]
+
+
+class SpatialHash:
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.rects = {}
+        self.order = {}
+
+    def clear(self):
+        self.cells.clear()
+        self.rects.clear()
+        self.order.clear()
+
+    def cell_keys(self, rect):
+        size = self.cell_size
+        for cx in range(rect[0] // size, (rect[0] + rect[2]) // size + 1):
+            for cy in range(rect[1] // size, (rect[1] + rect[3]) // size + 1):
+                yield cx, cy
+
+    def insert(self, item, rect):
+        # хранится копия: rect() сущности - один и тот же Rect, который меняется при следующем вызове
+        rect = tuple(rect)
+        self.rects[item] = rect
+        self.order[item] = len(self.order)
+        for key in self.cell_keys(rect):
+            cell = self.cells.get(key)
+            if cell is None:
+                self.cells[key] = [item]
+            else:
+                cell.append(item)
+
+    def rebuild(self, items):
+        # пересобирается каждый тик по текущим прямоугольникам сущностей
+        self.clear()
+        for item in items:
+            self.insert(item, item.rect())
+
+    def remove(self, item):
+        rect = self.rects.pop(item, None)
+        if rect is None:
+            return
+        del self.order[item]
+        for key in self.cell_keys(rect):
+            self.cells[key].remove(item)
+
+    def query(self, rect):
+        found = []
+        left, top, width, height = rect
+        for key in self.cell_keys(rect):
+            cell = self.cells.get(key)
+            if not cell:
+                continue
+            for item in cell:
+                if item in found:
+                    continue
+                item_left, item_top, item_width, item_height = self.rects[item]
+                if (item_left < left + width and left < item_left + item_width
+                        and item_top < top + height and top < item_top + item_height):
+                    found.append(item)
+        if len(found) > 1:
+            found.sort(key=self.order.__getitem__)
+        return found
@@ -1,7 +1,13 @@
 import json
+import math
+import os
+from array import array
 
 import pygame
 
+from scripts.mapformat import MapFile, is_binary_map, type_mask, write_map
+from scripts.spatial import SpatialGrid
+
 AUTOTILE_MAP = {
     tuple(sorted([(1, 0), (0, 1)])): 0,
     tuple(sorted([(1, 0), (0, 1), (-1, 0)])): 1,
@@ -14,6 +20,17 @@ AUTOTILE_MAP = {
     tuple(sorted([(1, 0), (-1, 0), (0, 1), (0, -1)])): 8,
 }
 
+# маска соседей того же типа: бит на каждое направление, индекс в AUTOTILE_VARIANTS
+AUTOTILE_BITS = {
+    (1, 0): 1,
+    (-1, 0): 2,
+    (0, -1): 4,
+    (0, 1): 8
+}
+AUTOTILE_VARIANTS = [None] * 16
+for neighbors, variant in AUTOTILE_MAP.items():
+    AUTOTILE_VARIANTS[sum(AUTOTILE_BITS[shift] for shift in neighbors)] = variant
+
 NEIGHBOR_OFFSETS = [(-1, 0),
                     (-1, -1),
                     (0, -1),
@@ -32,90 +49,731 @@ AUTOTILE_TYPES = {
     'stone'
 }
 
+# чанк - квадрат CHUNK_SIZE x CHUNK_SIZE тайлов
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+EMPTY = -1
+OFFGRID_CELL_SIZE = 64
+DIRTY_CHUNK_LIMIT = 64
+# готовых картинок чанков больше этого - дальние от камеры (дальше SURFACE_MARGIN чанков) выбрасываются
+CHUNK_SURFACE_LIMIT = 64
+SURFACE_MARGIN = 2
+
+
+def first_cell(start, tile_size):
+    return math.floor(start / tile_size)
+
+
+def last_cell(start, size, tile_size):
+    # последняя клетка отрезка [start, start + size), у точки (size = 0) - ее собственная клетка
+    if size:
+        return math.ceil((start + size) / tile_size) - 1
+    return math.floor(start / tile_size)
+
+
+def save_map(path, tile_size, tiles, offgrid):
+    # tiles - список (x, y, тип, вариант); пишется во временный файл и подменяет старый целиком
+    if is_binary_map(path):
+        write_map(path, tile_size, CHUNK_SIZE, tiles, offgrid)
+        return
+
+    tilemap = {}
+    for x, y, tile_type, variant in tiles:
+        tilemap[str(x) + ';' + str(y)] = {
+            'type': tile_type,
+            'variant': variant,
+            'pos': [x, y]
+        }
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'w')
+    json.dump({
+        'tilemap': tilemap,
+        'tile_size': tile_size,
+        'offgrid': offgrid
+    },
+        f)
+    f.close()
+    os.replace(tmp_path, path)
+
+
+class Chunk:
+    def __init__(self, pos):
+        self.pos = pos
+        self.types = array('h', [EMPTY]) * (CHUNK_SIZE * CHUNK_SIZE)
+        self.variants = array('h', [0]) * (CHUNK_SIZE * CHUNK_SIZE)
+        self.count = 0
+
+    def cells(self):
+        base_x = self.pos[0] << CHUNK_SHIFT
+        base_y = self.pos[1] << CHUNK_SHIFT
+        types = self.types
+        for i in range(CHUNK_SIZE * CHUNK_SIZE):
+            if types[i] != EMPTY:
+                yield (base_x + (i & CHUNK_MASK),
+                       base_y + (i >> CHUNK_SHIFT),
+                       types[i],
+                       self.variants[i])
+
 
 class Tilemap:
     def __init__(self, game, tile_size=16):
         self.game = game
         self.tile_size = tile_size
-        self.tilemap = {}
+        self.chunks = {}
+        self.tile_types = []
+        self.type_ids = {}
+        self.solid_types = []
         self.offgrid_tiles = []
+        self.offgrid_index = SpatialGrid(OFFGRID_CELL_SIZE)
+        self.chunk_surfaces = {}
+        self.solid_cache = None
+        # твердые тайлы каждого чанка, слитые в крупные прямоугольники
+        self.collision_rects = {}
+        self.physics_rects = []
+        self.physics_area = pygame.Rect(0, 0, 0, 0)
+        # чанки бинарной карты, которые еще не прочитаны из файла
+        self.map_file = None
+        self.file_type_ids = []
+        self.pending_chunks = {}
+        # что изменено с последней записи в файл карты
+        self.dirty_chunks = set()
+        self.offgrid_dirty = False
+        # границы карты для bounds(); сбрасываются, когда чанк появляется или исчезает
+        self.bounds_cache = None
+
+    def type_id(self, tile_type):
+        if tile_type not in self.type_ids:
+            self.type_ids[tile_type] = len(self.tile_types)
+            self.tile_types.append(tile_type)
+            self.solid_types.append(tile_type in PHYSICS_TILES)
+        return self.type_ids[tile_type]
+
+    def clear(self):
+        self.close_map_file()
+        self.chunks = {}
+        self.bounds_cache = None
+        self.offgrid_tiles = []
+        self.offgrid_index.clear()
+        self.chunk_surfaces = {}
+        self.solid_cache = None
+        self.collision_rects = {}
+
+    def close_map_file(self):
+        if self.map_file is not None:
+            self.map_file.close()
+            self.map_file = None
+        self.pending_chunks = {}
+        self.dirty_chunks = set()
+        self.offgrid_dirty = False
+        self.bounds_cache = None
+
+    def load_chunk(self, key):
+        del self.pending_chunks[key]
+        chunk = self.chunks[key] = Chunk(key)
+        file_type_ids = self.file_type_ids
+        for x, y, type_id, variant in self.map_file.chunk_records(key):
+            i = (y << CHUNK_SHIFT) | x
+            if chunk.types[i] == EMPTY:
+                chunk.count += 1
+            chunk.types[i] = file_type_ids[type_id]
+            chunk.variants[i] = variant
+        return chunk
+
+    def load_all_chunks(self):
+        for key in list(self.pending_chunks):
+            self.load_chunk(key)
+        self.close_map_file()
+
+    def write_back(self):
+        # измененные чанки и тайлы вне сетки дописываются в файл карты, остальное не переписывается
+        if self.map_file is None or not (self.dirty_chunks or self.offgrid_dirty):
+            return False
+        tile_types = list(self.map_file.tile_types)
+        file_ids = {tile_type: i for i, tile_type in enumerate(tile_types)}
+
+        def file_id(type_id):
+            tile_type = self.tile_types[type_id]
+            if tile_type not in file_ids:
+                file_ids[tile_type] = len(tile_types)
+                tile_types.append(tile_type)
+            return file_ids[tile_type]
+
+        chunks = {}
+        for key in self.dirty_chunks:
+            records = []
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                for i, type_id in enumerate(chunk.types):
+                    if type_id != EMPTY:
+                        records.append((i & CHUNK_MASK, i >> CHUNK_SHIFT, file_id(type_id), chunk.variants[i]))
+            chunks[key] = records
+        offgrid = None
+        if self.offgrid_dirty:
+            offgrid = [(tile['pos'][0], tile['pos'][1], file_id(self.type_id(tile['type'])), tile['variant'])
+                       for tile in self.offgrid_tiles]
+
+        self.map_file.append(tile_types, chunks, offgrid)
+        self.file_type_ids = [self.type_id(tile_type) for tile_type in self.map_file.tile_types]
+        self.dirty_chunks = set()
+        self.offgrid_dirty = False
+        return True
+
+    def evict_chunks(self, rect, margin=1):
+        # чанки дальше margin чанков от rect (в пикселях) выгружаются обратно в файл;
+        # измененные остаются в памяти, пока их не больше DIRTY_CHUNK_LIMIT, потом записываются
+        # разом - каждая запись добавляет в файл новую таблицу чанков
+        if self.map_file is None:
+            return 0
+        min_cx, min_cy, max_cx, max_cy = self.chunk_range(rect, margin)
+        far = [key for key in self.chunks
+               if not (min_cx <= key[0] <= max_cx and min_cy <= key[1] <= max_cy)]
+        if len(self.dirty_chunks) > DIRTY_CHUNK_LIMIT:
+            self.write_back()
+        far = [key for key in far if key not in self.dirty_chunks]
+        for key in far:
+            self.unload_chunk(key)
+        return len(far)
+
+    def chunk_range(self, rect, margin):
+        # чанки, которые задевает rect (в пикселях), плюс margin чанков вокруг
+        size = self.chunk_pixel_size()
+        return (math.floor(rect[0] / size) - margin,
+                math.floor(rect[1] / size) - margin,
+                math.floor((rect[0] + rect[2]) / size) + margin,
+                math.floor((rect[1] + rect[3]) / size) + margin)
+
+    def drop_chunk_surfaces(self, rect, margin=SURFACE_MARGIN):
+        min_cx, min_cy, max_cx, max_cy = self.chunk_range(rect, margin)
+        far = [key for key in self.chunk_surfaces
+               if not (min_cx <= key[0] <= max_cx and min_cy <= key[1] <= max_cy)]
+        for key in far:
+            del self.chunk_surfaces[key]
+        return len(far)
+
+    def unload_chunk(self, key):
+        del self.chunks[key]
+        self.pending_chunks[key] = self.map_file.chunks[key]
+        self.chunk_surfaces.pop(key, None)
+        self.collision_rects.pop(key, None)
+
+    def chunk_types(self, key):
+        # типы клеток чанка; чанк, который еще в файле, читается во временный массив и в память карты не попадает
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            return chunk.types
+        if key not in self.pending_chunks:
+            return None
+        types = array('h', [EMPTY]) * (CHUNK_SIZE * CHUNK_SIZE)
+        file_type_ids = self.file_type_ids
+        for x, y, type_id, variant in self.map_file.chunk_records(key):
+            types[(y << CHUNK_SHIFT) | x] = file_type_ids[type_id]
+        return types
+
+    def chunk_at(self, key):
+        chunk = self.chunks.get(key)
+        if chunk is None and key in self.pending_chunks:
+            chunk = self.load_chunk(key)
+        return chunk
+
+    def chunk_pixel_size(self):
+        return self.tile_size * CHUNK_SIZE
+
+    def invalidate_rect(self, rect):
+        size = self.chunk_pixel_size()
+        for cx in range(math.floor(rect[0]) // size,
+                        math.floor(rect[0] + rect[2] - 1) // size + 1):
+            for cy in range(math.floor(rect[1]) // size,
+                            math.floor(rect[1] + rect[3] - 1) // size + 1):
+                self.chunk_surfaces.pop((cx, cy), None)
+
+    def invalidate_tile(self, x, y, tile_type, variant):
+        if self.chunk_surfaces:
+            img = self.game.assets[tile_type][variant]
+            self.invalidate_rect((x * self.tile_size,
+                                  y * self.tile_size,
+                                  img.get_width(),
+                                  img.get_height()))
+
+    def offgrid_rect(self, tile):
+        img = self.game.assets[tile['type']][tile['variant']]
+        return (tile['pos'][0],
+                tile['pos'][1],
+                img.get_width(),
+                img.get_height())
+
+    def add_offgrid(self, tile):
+        self.offgrid_tiles.append(tile)
+        self.offgrid_dirty = True
+        rect = self.offgrid_rect(tile)
+        self.offgrid_index.insert(tile, rect)
+        if self.chunk_surfaces:
+            self.invalidate_rect(rect)
+
+    def remove_offgrid(self, tile):
+        self.offgrid_tiles.remove(tile)
+        self.offgrid_index.remove(tile)
+        self.offgrid_dirty = True
+        if self.chunk_surfaces:
+            self.invalidate_rect(self.offgrid_rect(tile))
+
+    def offgrid_in_rect(self, rect):
+        return self.offgrid_index.query(rect)
+
+    def offgrid_at(self, pos):
+        return self.offgrid_index.query_point(pos)
+
+    def get_id(self, x, y):
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if key not in self.pending_chunks:
+                return EMPTY, 0
+            chunk = self.load_chunk(key)
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        return chunk.types[i], chunk.variants[i]
+
+    def is_solid(self, x, y):
+        type_id = self.get_id(x, y)[0]
+        return type_id != EMPTY and self.solid_types[type_id]
+
+    def solid_grid(self):
+        # сетка твердости всей карты: (x0, y0, ширина, высота, bytearray) в координатах тайлов
+        if self.solid_cache is None:
+            self.load_all_chunks()
+            if self.chunks:
+                min_x = min(key[0] for key in self.chunks) * CHUNK_SIZE
+                min_y = min(key[1] for key in self.chunks) * CHUNK_SIZE
+                width = (max(key[0] for key in self.chunks) + 1) * CHUNK_SIZE - min_x
+                height = (max(key[1] for key in self.chunks) + 1) * CHUNK_SIZE - min_y
+            else:
+                min_x = min_y = width = height = 0
+            grid = bytearray(width * height)
+            solid_types = self.solid_types
+            for chunk in self.chunks.values():
+                for x, y, type_id, variant in chunk.cells():
+                    if solid_types[type_id]:
+                        grid[(y - min_y) * width + x - min_x] = 1
+            self.solid_cache = (min_x, min_y, width, height, grid)
+        return self.solid_cache
+
+    def update_solid_cache(self, x, y, type_id):
+        min_x, min_y, width, height, grid = self.solid_cache
+        if 0 <= x - min_x < width and 0 <= y - min_y < height:
+            grid[(y - min_y) * width + x - min_x] = type_id != EMPTY and self.solid_types[type_id]
+        else:
+            self.solid_cache = None
+
+    def bounds(self):
+        # зовется каждый тик, в котором летят пули: чанки обходятся только после изменения их набора
+        if self.bounds_cache is None:
+            keys = list(self.chunks) + list(self.pending_chunks)
+            if not keys:
+                self.bounds_cache = (0, 0, 0, 0)
+            else:
+                size = self.chunk_pixel_size()
+                min_x = min(key[0] for key in keys)
+                min_y = min(key[1] for key in keys)
+                max_x = max(key[0] for key in keys)
+                max_y = max(key[1] for key in keys)
+                self.bounds_cache = (min_x * size,
+                                     min_y * size,
+                                     (max_x - min_x + 1) * size,
+                                     (max_y - min_y + 1) * size)
+        return self.bounds_cache
+
+    def get_tile(self, x, y):
+        type_id, variant = self.get_id(x, y)
+        if type_id == EMPTY:
+            return None
+        return {
+            'type': self.tile_types[type_id],
+            'variant': variant,
+            'pos': [x, y]
+        }
+
+    def set_tile(self, x, y, tile_type, variant):
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunk_at(key)
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk(key)
+            self.bounds_cache = None
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        if chunk.types[i] == EMPTY:
+            chunk.count += 1
+        else:
+            self.invalidate_tile(x, y, self.tile_types[chunk.types[i]], chunk.variants[i])
+        chunk.types[i] = self.type_id(tile_type)
+        chunk.variants[i] = variant
+        self.invalidate_tile(x, y, tile_type, variant)
+        self.collision_rects.pop(key, None)
+        self.dirty_chunks.add(key)
+        if self.solid_cache is not None:
+            self.update_solid_cache(x, y, chunk.types[i])
+
+    def remove_tile(self, x, y):
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunk_at(key)
+        if chunk is None:
+            return False
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        if chunk.types[i] == EMPTY:
+            return False
+        self.invalidate_tile(x, y, self.tile_types[chunk.types[i]], chunk.variants[i])
+        chunk.types[i] = EMPTY
+        chunk.variants[i] = 0
+        chunk.count -= 1
+        self.collision_rects.pop(key, None)
+        self.dirty_chunks.add(key)
+        if self.solid_cache is not None:
+            self.update_solid_cache(x, y, EMPTY)
+        if not chunk.count:
+            del self.chunks[key]
+            self.bounds_cache = None
+        return True
+
+    def tiles(self):
+        # чанки из файла карты читаются по одному и не остаются в памяти, файл не закрывается
+        for chunk in list(self.chunks.values()):
+            for x, y, type_id, variant in chunk.cells():
+                yield x, y, self.tile_types[type_id], variant
+        for key in list(self.pending_chunks):
+            if key not in self.pending_chunks:
+                continue
+            base_x = key[0] << CHUNK_SHIFT
+            base_y = key[1] << CHUNK_SHIFT
+            for x, y, type_id, variant in self.map_file.chunk_records(key):
+                yield base_x + x, base_y + y, self.tile_types[self.file_type_ids[type_id]], variant
 
     def tiles_around(self, pos):
         tiles = []
-        tile_loc = (int(pos[0] // self.tile_size),
-                    int(pos[1] // self.tile_size))
+        tile_x = int(pos[0] // self.tile_size)
+        tile_y = int(pos[1] // self.tile_size)
         for offset in NEIGHBOR_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] + offset[1])
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            tile = self.get_tile(tile_x + offset[0],
+                                 tile_y + offset[1])
+            if tile is not None:
+                tiles.append(tile)
         return tiles
 
     def save(self, path):
-        f = open(path, 'w')
-        json.dump({
-            'tilemap': self.tilemap,
-            'tile_size': self.tile_size,
-            'offgrid': self.offgrid_tiles
-        },
-            f)
-        f.close()
+        save_map(path, self.tile_size, list(self.tiles()), self.offgrid_tiles)
+
+    def load_binary(self, path):
+        self.clear()
+        map_file = MapFile(path)
+        self.tile_size = map_file.tile_size
+        self.file_type_ids = [self.type_id(tile_type) for tile_type in map_file.tile_types]
+        for tile in map_file.offgrid():
+            self.add_offgrid(tile)
+
+        if map_file.chunk_size == CHUNK_SIZE:
+            # чанки читаются из отображенного в память файла при первом обращении
+            self.map_file = map_file
+            self.pending_chunks = dict(map_file.chunks)
+            self.bounds_cache = None
+            self.offgrid_dirty = False
+        else:
+            for x, y, tile_type, variant in map_file.tiles():
+                self.set_tile(x, y, tile_type, variant)
+            map_file.close()
 
     def load(self, path):
+        if is_binary_map(path):
+            self.load_binary(path)
+            return
+
         f = open(path, 'r')
         map_data = json.load(f)
         f.close()
 
-        self.tilemap = map_data['tilemap']
+        self.clear()
+        for tile in map_data['tilemap'].values():
+            self.set_tile(tile['pos'][0],
+                          tile['pos'][1],
+                          tile['type'],
+                          tile['variant'])
         self.tile_size = map_data['tile_size']
-        self.offgrid_tiles = map_data['offgrid']
+        self.bounds_cache = None
+        for tile in map_data['offgrid']:
+            self.add_offgrid(tile)
 
     def solid_check(self, pos):
-        tile_loc = str(int(pos[0] // self.tile_size)) + ';' + str(int(pos[1] // self.tile_size))
-        if tile_loc in self.tilemap:
-            if self.tilemap[tile_loc]['type'] in PHYSICS_TILES:
-                return self.tilemap[tile_loc]
+        tile_x = int(pos[0] // self.tile_size)
+        tile_y = int(pos[1] // self.tile_size)
+        type_id, variant = self.get_id(tile_x, tile_y)
+        if type_id != EMPTY and self.solid_types[type_id]:
+            return self.get_tile(tile_x, tile_y)
 
-    def physics_rects_around(self, pos):
+    def merge_chunk(self, key):
+        # жадное слияние: полоса твердых клеток вправо, затем вниз, пока вся полоса твердая
         rects = []
-        for tile in self.tiles_around(pos):
-            if tile['type'] in PHYSICS_TILES:
-                rects.append(
-                    pygame.Rect(tile['pos'][0] * self.tile_size,
-                                tile['pos'][1] * self.tile_size,
-                                self.tile_size,
-                                self.tile_size))
+        chunk = self.chunk_at(key)
+        if chunk is not None:
+            solid_types = self.solid_types
+            solid = bytearray(CHUNK_SIZE * CHUNK_SIZE)
+            for i, type_id in enumerate(chunk.types):
+                if type_id != EMPTY and solid_types[type_id]:
+                    solid[i] = 1
+            tile_size = self.tile_size
+            for y in range(CHUNK_SIZE):
+                for x in range(CHUNK_SIZE):
+                    i = (y << CHUNK_SHIFT) | x
+                    if not solid[i]:
+                        continue
+                    width = 1
+                    while x + width < CHUNK_SIZE and solid[i + width]:
+                        width += 1
+                    height = 1
+                    while y + height < CHUNK_SIZE:
+                        start = i + (height << CHUNK_SHIFT)
+                        if solid.count(1, start, start + width) != width:
+                            break
+                        height += 1
+                    for row in range(height):
+                        start = i + (row << CHUNK_SHIFT)
+                        solid[start:start + width] = bytes(width)
+                    rects.append(pygame.Rect(((key[0] << CHUNK_SHIFT) + x) * tile_size,
+                                             ((key[1] << CHUNK_SHIFT) + y) * tile_size,
+                                             width * tile_size,
+                                             height * tile_size))
+        self.collision_rects[key] = rects
         return rects
 
+    def physics_rects_around(self, pos):
+        # слитые прямоугольники чанков, задевающие 3x3 тайла вокруг pos;
+        # список переиспользуется до следующего вызова, прямоугольники менять нельзя
+        rects = self.physics_rects
+        rects.clear()
+        tile_size = self.tile_size
+        tile_x = int(pos[0] // tile_size)
+        tile_y = int(pos[1] // tile_size)
+        area = self.physics_area
+        area.update((tile_x - 1) * tile_size,
+                    (tile_y - 1) * tile_size,
+                    3 * tile_size,
+                    3 * tile_size)
+        collides = area.colliderect
+        min_cx = (tile_x - 1) >> CHUNK_SHIFT
+        min_cy = (tile_y - 1) >> CHUNK_SHIFT
+        max_cx = (tile_x + 1) >> CHUNK_SHIFT
+        max_cy = (tile_y + 1) >> CHUNK_SHIFT
+        for cy in range(min_cy, max_cy + 1):
+            for cx in range(min_cx, max_cx + 1):
+                key = (cx, cy)
+                chunk_rects = self.collision_rects.get(key)
+                if chunk_rects is None:
+                    chunk_rects = self.merge_chunk(key)
+                for rect in chunk_rects:
+                    if collides(rect):
+                        rects.append(rect)
+        return rects
+
+    def sweep(self, x, y, w, h, dx, dy):
+        # прямоугольник (x, y, w, h) сдвигается на (dx, dy); обход клеток сетки вдоль пути,
+        # в которые входит передний край. возвращает (t, nx, ny): долю пути до первого касания
+        # твердой клетки и нормаль стенки; (1, 0, 0) - путь свободен. w = h = 0 - точка
+        tile_size = self.tile_size
+
+        if dx > 0:
+            next_col = last_cell(x, w, tile_size) + 1
+            end_col = last_cell(x + dx, w, tile_size)
+        elif dx < 0:
+            next_col = first_cell(x, tile_size) - 1
+            end_col = first_cell(x + dx, tile_size)
+        else:
+            next_col = end_col = None
+        if dy > 0:
+            next_row = last_cell(y, h, tile_size) + 1
+            end_row = last_cell(y + dy, h, tile_size)
+        elif dy < 0:
+            next_row = first_cell(y, tile_size) - 1
+            end_row = first_cell(y + dy, tile_size)
+        else:
+            next_row = end_row = None
+
+        while True:
+            t_col = t_row = None
+            if next_col is not None and (next_col <= end_col if dx > 0 else next_col >= end_col):
+                if dx > 0:
+                    t_col = (next_col * tile_size - x - w) / dx
+                else:
+                    t_col = ((next_col + 1) * tile_size - x) / dx
+            if next_row is not None and (next_row <= end_row if dy > 0 else next_row >= end_row):
+                if dy > 0:
+                    t_row = (next_row * tile_size - y - h) / dy
+                else:
+                    t_row = ((next_row + 1) * tile_size - y) / dy
+            if t_col is None and t_row is None:
+                return 1, 0, 0
+
+            if t_row is None or (t_col is not None and t_col <= t_row):
+                t = t_col
+                top = y + dy * t
+                for row in range(first_cell(top, tile_size), last_cell(top, h, tile_size) + 1):
+                    if self.is_solid(next_col, row):
+                        return t, (-1 if dx > 0 else 1), 0
+                next_col += 1 if dx > 0 else -1
+            else:
+                t = t_row
+                left = x + dx * t
+                for col in range(first_cell(left, tile_size), last_cell(left, w, tile_size) + 1):
+                    if self.is_solid(col, next_row):
+                        return t, 0, (-1 if dy > 0 else 1)
+                next_row += 1 if dy > 0 else -1
+
     def autotile(self):
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            neighbors = set()
-            for shift in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
-                check_loc = str(tile['pos'][0] + shift[0]) + ';' + str(tile['pos'][1] + shift[1])
-                if check_loc in self.tilemap:
-                    if self.tilemap[check_loc]['type'] == tile['type']:
-                        neighbors.add(shift)
-            neighbors = tuple(sorted(neighbors))
-            if (tile['type'] in AUTOTILE_TYPES) and (neighbors in AUTOTILE_MAP):
-                tile['variant'] = AUTOTILE_MAP[neighbors]
+        # каждый чанк копируется в сетку id типов с рамкой в клетку из соседних чанков, маска соседей
+        # считается сдвигами индекса на 1 и на ширину сетки. чанки из файла карты читаются во временные
+        # массивы (хранятся только два последних ряда чанков), в память карты попадают только измененные;
+        # когда измененных больше DIRTY_CHUNK_LIMIT, они дописываются в файл и выгружаются.
+        # возвращает изменения (x, y, тип, старый вариант, новый вариант)
+        changes = []
+        keys = sorted(list(self.chunks) + list(self.pending_chunks), key=lambda key: (key[1], key[0]))
+        if not keys:
+            return changes
+        autotile_ids = [tile_type in AUTOTILE_TYPES for tile_type in self.tile_types]
+        resident = set(self.chunks)
+        width = CHUNK_SIZE + 2
+        types_cache = {}
 
-    def render(self, surf, offset=(0, 0)):
-        for tile in self.offgrid_tiles:
+        def types_of(key):
+            if key not in types_cache:
+                types_cache[key] = self.chunk_types(key)
+            return types_cache[key]
+
+        row_y = keys[0][1]
+        for key in keys:
+            if key[1] != row_y:
+                row_y = key[1]
+                for old in [old for old in types_cache if old[1] < row_y - 1]:
+                    del types_cache[old]
+                if self.map_file is not None and len(self.dirty_chunks) > DIRTY_CHUNK_LIMIT:
+                    self.write_back()
+                    for loaded in [loaded for loaded in self.chunks if loaded not in resident]:
+                        self.unload_chunk(loaded)
+                        types_cache.pop(loaded, None)
+
+            types = types_of(key)
+            if not any(type_id != EMPTY and autotile_ids[type_id] for type_id in set(types)):
+                continue
+            grid = array('h', [EMPTY]) * (width * width)
+            for row in range(CHUNK_SIZE):
+                start = (row + 1) * width + 1
+                grid[start:start + CHUNK_SIZE] = types[row << CHUNK_SHIFT:(row + 1) << CHUNK_SHIFT]
+            up = types_of((key[0], key[1] - 1))
+            if up is not None:
+                grid[1:1 + CHUNK_SIZE] = up[CHUNK_MASK << CHUNK_SHIFT:]
+            down = types_of((key[0], key[1] + 1))
+            if down is not None:
+                grid[(width - 1) * width + 1:(width - 1) * width + 1 + CHUNK_SIZE] = down[:CHUNK_SIZE]
+            left = types_of((key[0] - 1, key[1]))
+            right = types_of((key[0] + 1, key[1]))
+            for row in range(CHUNK_SIZE):
+                if left is not None:
+                    grid[(row + 1) * width] = left[(row << CHUNK_SHIFT) | CHUNK_MASK]
+                if right is not None:
+                    grid[(row + 1) * width + width - 1] = right[row << CHUNK_SHIFT]
+
+            chunk = None
+            for i in range(CHUNK_SIZE * CHUNK_SIZE):
+                type_id = types[i]
+                if type_id == EMPTY or not autotile_ids[type_id]:
+                    continue
+                g = (i >> CHUNK_SHIFT) * width + width + 1 + (i & CHUNK_MASK)
+                variant = AUTOTILE_VARIANTS[(grid[g + 1] == type_id)
+                                            | (grid[g - 1] == type_id) << 1
+                                            | (grid[g - width] == type_id) << 2
+                                            | (grid[g + width] == type_id) << 3]
+                if variant is None:
+                    continue
+                if chunk is None:
+                    chunk = self.chunk_at(key)
+                if chunk.variants[i] != variant:
+                    changes.append(((key[0] << CHUNK_SHIFT) + (i & CHUNK_MASK),
+                                    (key[1] << CHUNK_SHIFT) + (i >> CHUNK_SHIFT),
+                                    self.tile_types[type_id],
+                                    chunk.variants[i],
+                                    variant))
+                    chunk.variants[i] = variant
+                    self.dirty_chunks.add(key)
+            if chunk is not None and key not in resident and key not in self.dirty_chunks:
+                # чанк загружен зря - ничего не поменялось
+                self.unload_chunk(key)
+        self.chunk_surfaces = {}
+        return changes
+
+    def autotile_cell(self, x, y):
+        type_id, variant = self.get_id(x, y)
+        if type_id == EMPTY or self.tile_types[type_id] not in AUTOTILE_TYPES:
+            return
+        mask = 0
+        for shift, bit in AUTOTILE_BITS.items():
+            if self.get_id(x + shift[0], y + shift[1])[0] == type_id:
+                mask |= bit
+        new_variant = AUTOTILE_VARIANTS[mask]
+        if new_variant is None or new_variant == variant:
+            return
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        self.chunks[key].variants[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)] = new_variant
+        self.dirty_chunks.add(key)
+        tile_type = self.tile_types[type_id]
+        self.invalidate_tile(x, y, tile_type, variant)
+        self.invalidate_tile(x, y, tile_type, new_variant)
+
+    def autotile_around(self, x, y):
+        # после изменения одной клетки меняться могут только она и 4 ее соседа
+        self.autotile_cell(x, y)
+        for shift in AUTOTILE_BITS:
+            self.autotile_cell(x + shift[0], y + shift[1])
+
+    def render_chunk(self, key):
+        size = self.chunk_pixel_size()
+        origin = (key[0] * size, key[1] * size)
+        surf = pygame.Surface((size, size))
+        empty = True
+
+        for tile in self.offgrid_in_rect((origin[0], origin[1], size, size)):
             surf.blit(self.game.assets[tile['type']][tile['variant']],
-                      (tile['pos'][0] - offset[0],
-                       tile['pos'][1] - offset[1]))
-
-        for x in range(offset[0] // self.tile_size,
-                       (offset[0] + surf.get_width()) // self.tile_size + 1):
-            for y in range(offset[1] // self.tile_size,
-                           (offset[1] + surf.get_height()) // self.tile_size + 1):
-                loc = str(x) + ';' + str(y)
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    surf.blit(self.game.assets[tile['type']][tile['variant']],
-                              (
-                                  tile['pos'][0] * self.tile_size - offset[0],
-                                  tile['pos'][1] * self.tile_size - offset[1]))
+                      (math.floor(tile['pos'][0]) - origin[0],
+                       math.floor(tile['pos'][1]) - origin[1]))
+            empty = False
+
+        # тайлы соседних чанков слева и сверху, которые больше клетки, заходят в этот чанк
+        for shift in [(-1, -1), (0, -1), (-1, 0), (0, 0)]:
+            chunk = self.chunk_at((key[0] + shift[0], key[1] + shift[1]))
+            if chunk is None:
+                continue
+            for x, y, type_id, variant in chunk.cells():
+                img = self.game.assets[self.tile_types[type_id]][variant]
+                pos = (x * self.tile_size - origin[0],
+                       y * self.tile_size - origin[1])
+                if pos[0] + img.get_width() > 0 and pos[1] + img.get_height() > 0:
+                    surf.blit(img, pos)
+                    empty = False
+
+        if empty:
+            return None
+        surf.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        return surf
+
+    def render(self, surf, offset=(0, 0)):
+        size = self.chunk_pixel_size()
+        for cx in range(offset[0] // size,
+                        (offset[0] + surf.get_width()) // size + 1):
+            for cy in range(offset[1] // size,
+                            (offset[1] + surf.get_height()) // size + 1):
+                key = (cx, cy)
+                if key in self.chunk_surfaces:
+                    chunk_surf = self.chunk_surfaces[key]
+                else:
+                    chunk_surf = self.chunk_surfaces[key] = self.render_chunk(key)
+                if chunk_surf is not None:
+                    surf.blit(chunk_surf,
+                              (cx * size - offset[0],
+                               cy * size - offset[1]))
+        if len(self.chunk_surfaces) > CHUNK_SURFACE_LIMIT:
+            self.drop_chunk_surfaces((offset[0], offset[1], surf.get_width(), surf.get_height()))
 
     def extract(self, id_pairs, keep=False):
         matches = []
@@ -123,15 +781,29 @@ class Tilemap:
             if (tile['type'], tile['variant']) in id_pairs:
                 matches.append(tile.copy())
                 if not keep:
-                    self.offgrid_tiles.remove(tile)
+                    self.remove_offgrid(tile)
 
-        for loc, tile in list(self.tilemap.items()):
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                matches[-1]['pos'] = matches[-1]['pos'].copy()
-                matches[-1]['pos'][0] *= self.tile_size
-                matches[-1]['pos'][1] *= self.tile_size
+        if self.pending_chunks:
+            # из файла читаются только чанки, в которых есть нужные типы
+            wanted_types = {pair[0] for pair in id_pairs}
+            wanted = type_mask([file_id for file_id, tile_type in enumerate(self.map_file.tile_types)
+                                if tile_type in wanted_types])
+            for key, entry in list(self.pending_chunks.items()):
+                if entry[2] & wanted:
+                    self.load_chunk(key)
+
+        for chunk in list(self.chunks.values()):
+            for x, y, type_id, variant in chunk.cells():
+                tile_type = self.tile_types[type_id]
+                if (tile_type, variant) not in id_pairs:
+                    continue
+                matches.append({
+                    'type': tile_type,
+                    'variant': variant,
+                    'pos': [x * self.tile_size,
+                            y * self.tile_size]
+                })
                 if not keep:
-                    del self.tilemap[loc]
+                    self.remove_tile(x, y)
 
         return matches
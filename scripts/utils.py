@@ -1,26 +1,84 @@
+import json
 import os
 
 import pygame
 
 BASE_IMG_PATH = 'data/images/'
+ATLAS_IMAGE_PATH = 'data/atlas.png'
+ATLAS_INDEX_PATH = 'data/atlas.json'
 
 
-def load_image(path):
-    img = pygame.image.load(BASE_IMG_PATH + path).convert()
-    img.set_colorkey((0, 0, 0))
+class Atlas:
+    def __init__(self, image_path=ATLAS_IMAGE_PATH, index_path=ATLAS_INDEX_PATH):
+        with open(index_path, 'r') as f:
+            self.rects = json.load(f)['images']
+        # обе копии делаются сразу, исходная картинка после этого не хранится
+        source = pygame.image.load(image_path)
+        self.surface = source.convert()
+        self.alpha_surface = source.convert_alpha()
+
+    def listdir(self, path):
+        prefix = path + '/'
+        return [name[len(prefix):] for name in self.rects
+                if name.startswith(prefix) and '/' not in name[len(prefix):]]
+
+    def image(self, path, alpha=False):
+        if alpha:
+            return self.alpha_surface.subsurface(self.rects[path])
+        return self.surface.subsurface(self.rects[path])
+
+
+atlas = None
+
+
+def get_atlas():
+    # атлас собирается командой python -m scripts.atlas, без него картинки грузятся по одной
+    global atlas
+    if atlas is None:
+        if os.path.exists(ATLAS_IMAGE_PATH) and os.path.exists(ATLAS_INDEX_PATH):
+            atlas = Atlas()
+        else:
+            atlas = False
+    return atlas
+
+
+def load_image(path, alpha=False):
+    packed = get_atlas()
+    if packed and path in packed.rects:
+        img = packed.image(path, alpha)
+    elif alpha:
+        img = pygame.image.load(BASE_IMG_PATH + path).convert_alpha()
+    else:
+        img = pygame.image.load(BASE_IMG_PATH + path).convert()
+    if not alpha:
+        img.set_colorkey((0, 0, 0))
     return img
 
 
 def load_images(path):
     images = []
-    for img_name in sorted(os.listdir(BASE_IMG_PATH + path)):
+    packed = get_atlas()
+    names = packed.listdir(path) if packed else []
+    if not names:
+        names = os.listdir(BASE_IMG_PATH + path)
+    for img_name in sorted(names):
         images.append(load_image(path + '/' + img_name))
     return images
 
 
+def flip_images(images):
+    return [pygame.transform.flip(img, True, False) for img in images]
+
+
 class Animation:
-    def __init__(self, images, img_dur=5, loop=True):
+    __slots__ = ('images', 'flipped_images', 'loop', 'image_duration', 'done', 'frame')
+
+    def __init__(self, images, img_dur=5, loop=True, flipped_images=None):
         self.images = images
+        # отраженные кадры считаются один раз и общие для всех копий анимации
+        if flipped_images is None:
+            flipped_images = flip_images(images)
+        self.flipped_images = flipped_images
         self.loop = loop
         self.image_duration = img_dur
         self.done = False
@@ -29,7 +87,12 @@ class Animation:
     def copy(self):
         return Animation(self.images,
                          self.image_duration,
-                         self.loop)
+                         self.loop,
+                         self.flipped_images)
+
+    def reset(self):
+        self.frame = 0
+        self.done = False
 
     def update(self):
         if self.loop:
@@ -40,5 +103,7 @@ class Animation:
             if self.frame >= self.image_duration * len(self.images) - 1:
                 self.done = True
 
-    def img(self):
+    def img(self, flip=False):
+        if flip:
+            return self.flipped_images[int(self.frame / self.image_duration)]
         return self.images[int(self.frame / self.image_duration)]